@@ -0,0 +1,234 @@
+"""
+asyncio driver that keeps the steps of many envs in flight
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Every env has its own agent. An env step (or reset) runs on a thread of its own, so the steps of
+all envs overlap, while the agents all run on the event loop: observations are queued as they
+arrive and every one gets its action computed right away, in arrival order, then the next step of
+its env is sent. Per env it records the latency of
+    env      from sending a step until its observation arrived
+    wait     from arrival until the agent started on it (another agent was running)
+    agent    agent.step
+as histograms over profiling.LATENCY_BINS, and the queue depth (observations waiting behind the one
+taken) every time an observation is taken.
+    --mode sync: the plain loop, envs stepped one after the other, for comparison
+    --step_latency: the stand-in env sleeps this long every step, like the round trip to a StarCraft II
+        process, the pure python stand-in itself holds the GIL and hardly overlaps
+
+Usage:
+    python -m pysc2.agents.async_runner --agents BuildMarines --envs 8 --step_latency 0.005 --mode both
+(--agents, --episodes, --env, --step_mul, --screen_size, --seed and --output are the flags of evaluate.py,
+--output gets one json line appended per run, with "mode" where evaluate.py's lines have "episode")
+"""
+
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import json
+import time
+
+from absl import app
+from absl import flags
+
+from . import evaluate
+from . import final_agent_lzh
+from . import profiling
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer("envs", 4, "Envs stepped at once, each with its own agent.")
+flags.DEFINE_float("step_latency", 0., "Seconds every step of the stand-in env sleeps.")
+flags.DEFINE_enum("mode", "async", ["async", "sync", "both"], "Overlapping driver, plain loop, or both.")
+
+PHASES = ("env", "wait", "agent")
+
+
+class EnvStats:
+    __slots__ = ("steps", "scores", "score", "seconds", "histograms", "depths")
+
+    def __init__(self):
+        self.steps = 0
+        self.scores = [] # of the finished episodes
+        self.score = 0. # of the running episode
+        self.seconds = dict.fromkeys(PHASES, 0.)
+        self.histograms = {phase: [0] * (len(profiling.LATENCY_BINS) + 1) for phase in PHASES}
+        self.depths = collections.Counter() # queue depth -> times seen
+
+    def record_latency(self, phase, seconds):
+        self.seconds[phase] += seconds
+        self.histograms[phase][bisect.bisect_left(profiling.LATENCY_BINS, seconds)] += 1
+
+    def snapshot(self):
+        latency = {}
+        for phase in PHASES:
+            calls = sum(self.histograms[phase])
+            latency[phase] = {
+                "mean": self.seconds[phase] / calls if calls else 0.,
+                "p50": profiling.percentile(self.histograms[phase], 0.5),
+                "p99": profiling.percentile(self.histograms[phase], 0.99),
+            }
+        seen = sum(self.depths.values())
+        return {
+            "steps": self.steps,
+            "episodes": len(self.scores),
+            "scores": list(self.scores),
+            "latency": latency,
+            "queue_depth": {
+                "mean": sum(depth * cnt for depth, cnt in self.depths.items()) / seen if seen else 0.,
+                "max": max(self.depths) if self.depths else 0,
+            },
+        }
+
+
+def _timed(clock, func, *argv):
+    # runs on the env's thread, so the arrival time is not delayed by the event loop
+    result = func(*argv)
+    return result, clock()
+
+
+async def run_async(envs, agents, episodes, clock=time.perf_counter):
+    """
+    play episodes episodes in every env, with the steps of all envs in flight at once
+    :return stats: one EnvStats per env
+    """
+    loop = asyncio.get_running_loop()
+    arrivals = asyncio.Queue() # (env, future of (timesteps, arrival time), time sent)
+    stats = [EnvStats() for _ in envs]
+
+    def send(executor, i, func, *argv):
+        sent = clock()
+        future = loop.run_in_executor(executor, _timed, clock, func, *argv)
+        future.add_done_callback(lambda future: arrivals.put_nowait((i, future, sent)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(envs)) as executor:
+        for i, env in enumerate(envs):
+            agents[i].reset()
+            send(executor, i, env.reset)
+        running = len(envs)
+        while running:
+            i, future, sent = await arrivals.get()
+            timesteps, arrived = future.result()
+            start = clock()
+            stats[i].depths[arrivals.qsize()] += 1
+            stats[i].record_latency("env", arrived - sent)
+            stats[i].record_latency("wait", start - arrived)
+            action = agents[i].step(timesteps[0])
+            stats[i].record_latency("agent", clock() - start)
+            stats[i].steps += 1
+            stats[i].score += timesteps[0].reward or 0
+
+            if not timesteps[0].last():
+                send(executor, i, envs[i].step, [action])
+                continue
+            stats[i].scores.append(stats[i].score)
+            stats[i].score = 0.
+            if len(stats[i].scores) < episodes:
+                agents[i].reset()
+                send(executor, i, envs[i].reset)
+            else:
+                running -= 1
+    return stats
+
+def run_sync(envs, agents, episodes, clock=time.perf_counter):
+    """
+    the plain loop: every env in turn is stepped, then its agent is
+    :return stats: one EnvStats per env
+    """
+    stats = [EnvStats() for _ in envs]
+    timesteps = []
+    for env, agent in zip(envs, agents):
+        agent.reset()
+        timesteps.append(env.reset())
+    running = list(range(len(envs)))
+    while running:
+        for i in list(running):
+            start = clock()
+            action = agents[i].step(timesteps[i][0])
+            stats[i].record_latency("agent", clock() - start)
+            stats[i].steps += 1
+            stats[i].score += timesteps[i][0].reward or 0
+            if timesteps[i][0].last():
+                stats[i].scores.append(stats[i].score)
+                stats[i].score = 0.
+                if len(stats[i].scores) == episodes:
+                    running.remove(i)
+                    continue
+                agents[i].reset()
+                timesteps[i] = envs[i].reset()
+                continue
+            sent = clock()
+            timesteps[i] = envs[i].step([action])
+            stats[i].record_latency("env", clock() - sent)
+            stats[i].record_latency("wait", 0.)
+            stats[i].depths[0] += 1
+    return stats
+
+def make_envs_and_agents(agent_name, n_envs, env_name="minigame", step_mul=8, screen_size=84, seed=0,
+                         step_latency=0.):
+    envs = [evaluate.make_env(env_name, agent_name, step_mul, screen_size, seed + i, step_latency)
+            for i in range(n_envs)]
+    agents = []
+    for env in envs:
+        agent = getattr(final_agent_lzh, agent_name)()
+        agent.setup(env.observation_spec()[0], env.action_spec()[0])
+        agents.append(agent)
+    return envs, agents
+
+def drive(mode, agent_name, n_envs, episodes, env_name="minigame", step_mul=8, screen_size=84, seed=0,
+          step_latency=0.):
+    """
+    :return result: dict of mode, agent, steps, seconds, steps_per_second and the snapshot of every env
+    """
+    envs, agents = make_envs_and_agents(agent_name, n_envs, env_name, step_mul, screen_size, seed, step_latency)
+    try:
+        start = time.perf_counter()
+        if mode == "async":
+            stats = asyncio.run(run_async(envs, agents, episodes))
+        else:
+            stats = run_sync(envs, agents, episodes)
+        seconds = time.perf_counter() - start
+    finally:
+        for env in envs:
+            env.close()
+    steps = sum(s.steps for s in stats)
+    return {"mode": mode, "agent": agent_name, "envs": n_envs, "steps": steps, "seconds": seconds,
+            "steps_per_second": steps / seconds, "per_env": [s.snapshot() for s in stats]}
+
+def report(result):
+    print("%s %s: %d envs, %d steps in %.2fs, %.0f steps/s" % (
+        result["agent"], result["mode"], result["envs"], result["steps"], result["seconds"],
+        result["steps_per_second"]))
+    print("    | env | steps | score | env p50 / p99 ms | wait p50 / p99 ms | agent p50 / p99 ms | queue mean / max |")
+    print("    | --- | ---: | ---: | --- | --- | --- | --- |")
+    for i, env in enumerate(result["per_env"]):
+        latency = env["latency"]
+        scores = env["scores"]
+        print("    | %d | %d | %.0f | %s | %s | %s | %.2f / %d |" % (
+            i, env["steps"], sum(scores) / len(scores) if scores else 0.,
+            " / ".join("%.2f" % (latency["env"][q] * 1e3) for q in ("p50", "p99")),
+            " / ".join("%.2f" % (latency["wait"][q] * 1e3) for q in ("p50", "p99")),
+            " / ".join("%.2f" % (latency["agent"][q] * 1e3) for q in ("p50", "p99")),
+            env["queue_depth"]["mean"], env["queue_depth"]["max"]))
+
+
+def main(unused_argv):
+    modes = ["sync", "async"] if FLAGS.mode == "both" else [FLAGS.mode]
+    for name in FLAGS.agents:
+        rates = {}
+        for mode in modes:
+            result = drive(mode, name, FLAGS.envs, FLAGS.episodes, FLAGS.env, FLAGS.step_mul, FLAGS.screen_size,
+                           FLAGS.seed, FLAGS.step_latency)
+            report(result)
+            if FLAGS.output:
+                # one json line per run, appended like the episodes of evaluate.py
+                with open(FLAGS.output, "a") as f:
+                    f.write(json.dumps(result) + "\n")
+            rates[mode] = result["steps_per_second"]
+        if len(rates) == 2:
+            print("%s async / sync throughput: %.2fx" % (name, rates["async"] / rates["sync"]))
+
+
+if __name__ == "__main__":
+    app.run(main)
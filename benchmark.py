@@ -0,0 +1,198 @@
+"""
+step latency benchmark for the agents and tactics, runs on the stand-in minigame environment
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+For each agent and unit count, observations are first recorded by running the agent
+in minigame_env.MiniGameEnv (padded up to the unit count), then replayed through a
+fresh agent so that only agent time is measured, the agent is reset (untimed) at the first
+observation of every episode. Reports p50/p99 latency, peak bytes allocated per call
+(tracemalloc peak of the call, not an allocation count) and throughput for:
+    <Agent>.step                    whole step of the agent
+    <Agent>.<tactic>.check          check_tactic_executable of every tactic in possible_tactic_list
+    unit_index                      building tactics.UnitIndex for an observation
+
+Usage:
+    python -m pysc2.agents.benchmark --output bench.json
+    python -m pysc2.agents.benchmark --baseline bench.json # exit code 1 if anything got slower than tolerance
+"""
+
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from absl import app
+from absl import flags
+
+from . import final_agent_lzh
+from . import minigame_env
+from . import tactics
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list("agents", list(minigame_env.MAPS), "Agents in final_agent_lzh to benchmark, on the map of the same name.")
+flags.DEFINE_list("unit_counts", ["10", "50", "200"], "Number of units on the map.")
+flags.DEFINE_integer("steps", 300, "Observations recorded per agent and unit count.")
+flags.DEFINE_integer("seed", 0, "Seed of the stand-in environment.")
+flags.DEFINE_string("output", None, "Write results as json to this file, else print them.")
+flags.DEFINE_string("baseline", None, "Results json of an earlier run to compare against.")
+flags.DEFINE_float("tolerance", 0.25, "Allowed relative increase of p50/p99 latency against the baseline.")
+
+
+def make_agent(agent_cls, env):
+    agent = agent_cls()
+    agent.setup(env.observation_spec()[0], env.action_spec()[0])
+    agent.reset()
+    return agent
+
+def record_observations(agent_cls, map_name, unit_count, steps, seed=0):
+    """
+    run agent_cls in the stand-in env and keep every observation it was given
+    """
+    env = minigame_env.MiniGameEnv(map_name, seed=seed, unit_count=unit_count)
+    agent = make_agent(agent_cls, env)
+    timesteps = env.reset()
+    observations = []
+    while len(observations) < steps:
+        observations.append(timesteps[0])
+        action = agent.step(timesteps[0])
+        if timesteps[0].last():
+            timesteps = env.reset()
+            agent.reset()
+        else:
+            timesteps = env.step([action])
+    return observations
+
+def step_prepare(agent):
+    """
+    :return prepare: resets agent at the first observation of an episode, like a run loop does,
+        and drops the unit index an earlier pass left on obs, as a live step builds it too
+    """
+    def prepare(obs):
+        tactics.clear_unit_index(obs)
+        if obs.first():
+            agent.reset()
+    return prepare
+
+def time_calls(func, observations, prepare=None):
+    """
+    :param prepare: called with obs before each call, not timed
+    """
+    latencies = np.zeros(len(observations))
+    for i, obs in enumerate(observations):
+        if prepare:
+            prepare(obs)
+        start = time.perf_counter()
+        func(obs)
+        latencies[i] = time.perf_counter() - start
+    return latencies
+
+def peak_bytes_per_call(func, observations, prepare=None):
+    """
+    :param prepare: called with obs before each call, not measured
+    :return peaks: peak bytes allocated above the start of each call
+    """
+    peaks = np.zeros(len(observations))
+    tracemalloc.start()
+    try:
+        for i, obs in enumerate(observations):
+            if prepare:
+                prepare(obs)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func(obs)
+            peaks[i] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def summarize(name, unit_count, latencies, peaks):
+    return {
+        "name": name,
+        "units": unit_count,
+        "calls": len(latencies),
+        "p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "p99_us": float(np.percentile(latencies, 99) * 1e6),
+        "mean_us": float(latencies.mean() * 1e6),
+        "peak_bytes_per_call": float(peaks.mean()),
+        "throughput_per_s": float(len(latencies) / latencies.sum()) if latencies.sum() > 0 else float("inf"),
+    }
+
+def benchmark_agent(agent_name, unit_count, steps, seed=0):
+    agent_cls = getattr(final_agent_lzh, agent_name)
+    env = minigame_env.MiniGameEnv(agent_name, seed=seed, unit_count=unit_count)
+    observations = record_observations(agent_cls, agent_name, unit_count, steps, seed)
+
+    # the agents are deterministic, so each pass replays the same decisions,
+    # the observations span several episodes, so the agent is reset where each one starts
+    timed_agent, traced_agent = make_agent(agent_cls, env), make_agent(agent_cls, env)
+    results = [summarize(agent_name + ".step", unit_count,
+                         time_calls(timed_agent.step, observations, step_prepare(timed_agent)),
+                         peak_bytes_per_call(traced_agent.step, observations, step_prepare(traced_agent)))]
+
+    agent = make_agent(agent_cls, env)
+    for tactic in getattr(agent, "possible_tactic_list", []):
+        def check(obs, tactic=tactic):
+            tactics.get_unit_index(obs) # index cost is reported on its own
+            start = time.perf_counter()
+            tactic.check_tactic_executable(obs)
+            return time.perf_counter() - start
+        latencies = np.array([check(obs) for obs in observations])
+        peaks = peak_bytes_per_call(lambda obs: tactic.check_tactic_executable(obs), observations)
+        results.append(summarize("%s.%s.check" % (agent_name, tactic.tactic.name or "tactic"),
+                                 unit_count, latencies, peaks))
+    return results
+
+def benchmark_unit_index(unit_count, steps, seed=0):
+    observations = record_observations(final_agent_lzh.DefeatRoaches, "DefeatRoaches", unit_count, steps, seed)
+    build = lambda obs: tactics.UnitIndex(obs.observation.feature_units)
+    return summarize("unit_index", unit_count, time_calls(build, observations), peak_bytes_per_call(build, observations))
+
+def compare(results, baseline, tolerance):
+    """
+    :return regressions: list of messages for results slower than baseline by more than tolerance
+    """
+    base = {(r["name"], r["units"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get((r["name"], r["units"]))
+        if b is None:
+            continue
+        for key in ["p50_us", "p99_us"]:
+            if r[key] > b[key] * (1 + tolerance):
+                regressions.append("%s units=%d %s: %.1f -> %.1f" % (r["name"], r["units"], key, b[key], r[key]))
+    return regressions
+
+def main(unused_argv):
+    results = []
+    for unit_count in [int(n) for n in FLAGS.unit_counts]:
+        results.append(benchmark_unit_index(unit_count, FLAGS.steps, FLAGS.seed))
+        for agent_name in FLAGS.agents:
+            results.extend(benchmark_agent(agent_name, unit_count, FLAGS.steps, FLAGS.seed))
+
+    report = {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                 "steps": FLAGS.steps, "seed": FLAGS.seed, "time": time.time()},
+        "results": results,
+    }
+    if FLAGS.output:
+        with open(FLAGS.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for r in results:
+        print("%-60s units=%-4d p50=%9.1fus p99=%9.1fus peak=%9.0fB %10.0f/s" % (
+            r["name"], r["units"], r["p50_us"], r["p99_us"], r["peak_bytes_per_call"], r["throughput_per_s"]))
+
+    if FLAGS.baseline:
+        with open(FLAGS.baseline) as f:
+            regressions = compare(results, json.load(f), FLAGS.tolerance)
+        for msg in regressions:
+            print("REGRESSION", msg)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,357 @@
+"""
+offline build order optimizer for BuildMarines and CollectMineralsAndGas
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+The thresholds of the tactic checks of these agents (build_order in final_agent_lzh.py) are searched
+without playing games: a vectorized economy model plays every candidate build order at once,
+one candidate per row of the state arrays (minerals, workers, buildings, queues),
+each agent decision advances all rows with a few numpy ops.
+Like TacticAgent, each decision executes the first tactic of possible_tactic_list whose check passes.
+    income: a worker brings MINERALS_PER_TRIP every MINING_TIME + MINERAL_WALK seconds,
+        only one worker mines a field at a time, so a field gives at most MINERALS_PER_TRIP / MINING_TIME
+        per second (the same for refineries and gas)
+    builds: the SCV walks BUILD_WALK seconds, then builds for build_time, buildings count for the checks
+        as soon as they are ordered, for food_cap and production once they are finished.
+        An idle SCV builds if there is one, else the first SCV (get_one_random_scv), which does
+        its builds one after the other and does not mine meanwhile
+    training: every finished CommandCenter / Barracks trains one unit at a time, up to MAX_QUEUE queued,
+        queued units count for food_used
+Costs, times and supply are the ones of minigame_env.
+
+The whole grid of SEARCH_SPACE is scored, split over a process pool with --processes,
+and the best build_order of every map is printed, ready to be assigned to the agent
+(with --validate, the best played one among the N best predicted).
+
+Usage:
+    python -m pysc2.agents.buildorder --output build_order.json
+    python -m pysc2.agents.buildorder --maps BuildMarines --validate 3 # also play the 3 best in minigame_env
+"""
+
+import collections
+import concurrent.futures
+import json
+
+import numpy as np
+from absl import app
+from absl import flags
+from pysc2.lib import units
+
+from . import final_agent_lzh
+from . import harvest
+from . import minigame_env
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list("maps", ["BuildMarines", "CollectMineralsAndGas"], "Maps to optimize the build order of.")
+flags.DEFINE_integer("processes", 1, "Processes to score the candidates with.")
+flags.DEFINE_integer("validate", 0, "Play the best N build orders of every map in minigame_env.")
+flags.DEFINE_integer("seed", 0, "Seed of minigame_env for --validate.")
+flags.DEFINE_string("output", None, "Write the best build order of every map as json to this file.")
+
+STEP_MUL = 8
+STEPS_PER_DECISION = 2 # select the executer, then exec
+MINERAL_WALK = 1.8 # seconds from the CommandCenter to a mineral field and back, on the minigame base
+GAS_WALK = 2.2 # seconds from the CommandCenter to a refinery and back
+BUILD_WALK = 2.0 # seconds an SCV walks to a building spot
+MAX_BUILDS = 32 # builds the first SCV can have lined up
+MINERAL_FIELDS = 7
+MINERALS_PER_FIELD = 1800
+START_SCVS = 12
+START_MINERALS = 50
+
+STATS = minigame_env.UNIT_STATS
+BUILDINGS = (units.Terran.CommandCenter, units.Terran.SupplyDepot, units.Terran.Barracks, units.Terran.Refinery)
+
+# values tried for every threshold of build_order, the defaults of the agents are included
+SEARCH_SPACE = {
+    "BuildMarines": collections.OrderedDict([
+        ("barracks", np.arange(1, 13)),
+        ("scvs", np.arange(12, 33)),
+        ("supply_depots", np.array([4, 8, 12, 16, 20, 25])),
+        ("supply_margin", np.arange(0, 7)),
+    ]),
+    "CollectMineralsAndGas": collections.OrderedDict([
+        ("command_centers", np.arange(1, 4)),
+        ("supply_depots", np.arange(0, 6)),
+        ("refineries", np.arange(0, 3)),
+        ("refinery_scvs", np.arange(12, 31)),
+    ]),
+}
+
+
+def candidate_grid(map_name):
+    """
+    :return candidates: threshold name -> [n] values, every combination of SEARCH_SPACE[map_name] once
+    """
+    space = SEARCH_SPACE[map_name]
+    grid = np.meshgrid(*space.values(), indexing="ij")
+    return collections.OrderedDict((name, values.ravel()) for name, values in zip(space, grid))
+
+
+class Economy:
+    """
+    state of n candidate games, every array has one row per candidate
+    """
+
+    def __init__(self, n, dt, game_seconds):
+        self.dt = dt
+        self.minerals = np.full(n, float(START_MINERALS))
+        self.collected = np.zeros(n) # minerals and gas brought back, the score of CollectMineralsAndGas
+        self.mined = np.zeros(n) # minerals taken out of the fields
+        self.idle = np.full(n, START_SCVS)
+        self.miners = np.zeros(n, dtype=np.int64)
+        self.gas_workers = np.zeros(n, dtype=np.int64)
+        self.scvs = np.full(n, START_SCVS)
+        self.marines = np.zeros(n, dtype=np.int64)
+        self.ordered = {unit_type: np.zeros(n, dtype=np.int64) for unit_type in BUILDINGS}
+        self.finished = {unit_type: np.zeros(n, dtype=np.int64) for unit_type in BUILDINGS}
+        self.ordered[units.Terran.CommandCenter][:] = 1
+        self.finished[units.Terran.CommandCenter][:] = 1
+        self.queue = {units.Terran.SCV: np.zeros(n, dtype=np.int64), units.Terran.Marine: np.zeros(n, dtype=np.int64)}
+        self.progress = {unit_type: np.zeros(n) for unit_type in self.queue}
+        # buildings (and their idle builders) finishing in each of the next decisions, a ring indexed by decision
+        longest = max(STATS[unit_type].build_time for unit_type in BUILDINGS) + BUILD_WALK
+        self._ring = int(np.ceil(longest / dt)) + 1
+        self._arrivals = {unit_type: np.zeros((n, self._ring), dtype=np.int64) for unit_type in BUILDINGS}
+        # builds lined up for the first SCV, a ring of (finish time, building) per candidate
+        self._builds_finish = np.full((n, MAX_BUILDS), np.inf)
+        self._builds_type = np.zeros((n, MAX_BUILDS), dtype=np.int64)
+        self._builds_head = np.zeros(n, dtype=np.int64)
+        self._builds_tail = np.zeros(n, dtype=np.int64)
+        self.builder_free = np.zeros(n) # time the first SCV finishes its last build
+        self.time = 0.
+        self.decision = 0
+        self.decisions = int(game_seconds / dt)
+
+    @property
+    def food_cap(self):
+        cap = minigame_env.FOOD_CAP
+        return np.minimum(200, cap[units.Terran.CommandCenter] * self.finished[units.Terran.CommandCenter] +
+                          cap[units.Terran.SupplyDepot] * self.finished[units.Terran.SupplyDepot])
+
+    @property
+    def food_used(self):
+        return self.scvs + self.marines + self.queue[units.Terran.SCV] + self.queue[units.Terran.Marine]
+
+    def can_train(self, unit_type, producer):
+        return (self.food_cap > self.food_used) & (self.finished[producer] >= 1) & \
+               (self.minerals >= STATS[unit_type].minerals) & \
+               (self.queue[unit_type] < minigame_env.MAX_QUEUE * self.finished[producer])
+
+    def can_build(self, unit_type):
+        return (self.minerals >= STATS[unit_type].minerals) & (self.scvs > 0) & \
+               ((self.idle > 0) | (self._builds_tail - self._builds_head < MAX_BUILDS))
+
+    def harvest(self, mask):
+        """
+        the idle SCV goes to the least saturated resource, like harvest.Harvest
+        """
+        refineries = self.finished[units.Terran.Refinery]
+        mineral_saturation = self.miners / (harvest.IDEAL * MINERAL_FIELDS)
+        gas_saturation = np.where(refineries > 0, self.gas_workers / (harvest.IDEAL_REFINERY * np.maximum(refineries, 1)), np.inf)
+        to_gas = mask & (gas_saturation < mineral_saturation)
+        self.gas_workers += to_gas
+        self.miners += mask & ~to_gas
+        self.idle -= mask
+
+    def build(self, unit_type, mask):
+        self.minerals -= mask * STATS[unit_type].minerals
+        self.ordered[unit_type] += mask
+        build_time = BUILD_WALK + STATS[unit_type].build_time
+        # an idle SCV builds right away
+        from_idle = mask & (self.idle > 0)
+        self.idle -= from_idle
+        delay = int(np.ceil(build_time / self.dt))
+        self._arrivals[unit_type][:, (self.decision + delay) % self._ring] += from_idle
+        # else the first SCV, after its earlier builds
+        rows = np.flatnonzero(mask & ~from_idle)
+        self.builder_free[rows] = np.maximum(self.builder_free[rows], self.time) + build_time
+        slots = self._builds_tail[rows] % MAX_BUILDS
+        self._builds_finish[rows, slots] = self.builder_free[rows]
+        self._builds_type[rows, slots] = BUILDINGS.index(unit_type)
+        self._builds_tail[rows] += 1
+
+    def train(self, unit_type, mask):
+        self.minerals -= mask * STATS[unit_type].minerals
+        self.queue[unit_type] += mask
+
+    def advance(self):
+        """
+        one decision worth of mining, building and training
+        """
+        dt = self.dt
+        trip = minigame_env.MINERALS_PER_TRIP
+        miners = np.maximum(self.miners - (self.builder_free > self.time), 0)
+        minerals = np.minimum(miners * trip / (minigame_env.MINING_TIME + MINERAL_WALK),
+                              MINERAL_FIELDS * trip / minigame_env.MINING_TIME) * dt
+        minerals = np.minimum(minerals, MINERAL_FIELDS * MINERALS_PER_FIELD - self.mined)
+        gas_trip = minigame_env.GAS_PER_TRIP
+        gas = np.minimum(self.gas_workers * gas_trip / (minigame_env.GAS_MINING_TIME + GAS_WALK),
+                         self.finished[units.Terran.Refinery] * gas_trip / minigame_env.GAS_MINING_TIME) * dt
+        self.mined += minerals
+        self.minerals += minerals
+        self.collected += minerals + gas
+
+        for unit_type, producer in ((units.Terran.SCV, units.Terran.CommandCenter),
+                                    (units.Terran.Marine, units.Terran.Barracks)):
+            queue = self.queue[unit_type]
+            self.progress[unit_type] += np.minimum(queue, self.finished[producer]) * dt / STATS[unit_type].build_time
+            done = np.minimum(np.floor(self.progress[unit_type]).astype(np.int64), queue)
+            self.progress[unit_type] -= done
+            self.progress[unit_type][queue == done] = 0.
+            queue -= done
+            if unit_type == units.Terran.SCV:
+                self.scvs += done
+                self.idle += done
+            else:
+                self.marines += done
+
+        self.decision += 1
+        self.time += dt
+        slot = self.decision % self._ring
+        for unit_type, arrivals in self._arrivals.items():
+            done = arrivals[:, slot].copy()
+            arrivals[:, slot] = 0
+            self.finished[unit_type] += done
+            self.idle += done
+        while True:
+            rows = np.flatnonzero(self._builds_head < self._builds_tail)
+            slots = self._builds_head[rows] % MAX_BUILDS
+            done = self._builds_finish[rows, slots] <= self.time
+            if not done.any():
+                break
+            rows, slots = rows[done], slots[done]
+            for k, unit_type in enumerate(BUILDINGS):
+                np.add.at(self.finished[unit_type], rows[self._builds_type[rows, slots] == k], 1)
+            self._builds_head[rows] += 1
+
+
+def _build_marines(economy, order):
+    """
+    possible_tactic_list of final_agent_lzh.BuildMarines, one decision
+    """
+    depots = economy.ordered[units.Terran.SupplyDepot]
+    barracks = economy.ordered[units.Terran.Barracks]
+    return [
+        (economy.idle > 0, economy.harvest),
+        ((economy.food_cap - economy.food_used <= order["supply_margin"]) & (depots < order["supply_depots"]) &
+         economy.can_build(units.Terran.SupplyDepot), lambda mask: economy.build(units.Terran.SupplyDepot, mask)),
+        ((barracks < order["barracks"]) & economy.can_build(units.Terran.Barracks),
+         lambda mask: economy.build(units.Terran.Barracks, mask)),
+        ((barracks >= order["barracks"]) & economy.can_train(units.Terran.Marine, units.Terran.Barracks),
+         lambda mask: economy.train(units.Terran.Marine, mask)),
+        ((economy.scvs < order["scvs"]) & economy.can_train(units.Terran.SCV, units.Terran.CommandCenter),
+         lambda mask: economy.train(units.Terran.SCV, mask)),
+    ]
+
+def _collect_minerals_and_gas(economy, order):
+    """
+    possible_tactic_list of final_agent_lzh.CollectMineralsAndGas, one decision
+    """
+    command_centers = economy.ordered[units.Terran.CommandCenter]
+    return [
+        ((command_centers < order["command_centers"]) & economy.can_build(units.Terran.CommandCenter),
+         lambda mask: economy.build(units.Terran.CommandCenter, mask)),
+        ((economy.ordered[units.Terran.SupplyDepot] < order["supply_depots"]) & (command_centers >= 2) &
+         (economy.food_cap == economy.food_used) & economy.can_build(units.Terran.SupplyDepot),
+         lambda mask: economy.build(units.Terran.SupplyDepot, mask)),
+        ((economy.ordered[units.Terran.Refinery] < order["refineries"]) & (economy.scvs >= order["refinery_scvs"]) &
+         economy.can_build(units.Terran.Refinery), lambda mask: economy.build(units.Terran.Refinery, mask)),
+        (economy.idle > 0, economy.harvest),
+        (economy.can_train(units.Terran.SCV, units.Terran.CommandCenter),
+         lambda mask: economy.train(units.Terran.SCV, mask)),
+    ]
+
+POLICIES = {
+    "BuildMarines": (_build_marines, lambda economy: economy.marines),
+    "CollectMineralsAndGas": (_collect_minerals_and_gas, lambda economy: economy.collected),
+}
+
+
+def simulate(map_name, candidates):
+    """
+    :param candidates: threshold name -> [n] values
+    :return scores: [n] score the model predicts for every candidate
+    """
+    policy, score = POLICIES[map_name]
+    n = len(next(iter(candidates.values())))
+    dt = STEP_MUL * STEPS_PER_DECISION / minigame_env.GAME_LOOPS_PER_SECOND
+    economy = Economy(n, dt, minigame_env.MAPS[map_name])
+    for _ in range(economy.decisions):
+        undecided = np.ones(n, dtype=bool)
+        for executable, execute in policy(economy, candidates):
+            mask = undecided & executable
+            if mask.any():
+                execute(mask)
+            undecided &= ~mask
+        economy.advance()
+    return np.asarray(score(economy), dtype=np.float64)
+
+def _simulate_chunk(args):
+    return simulate(*args)
+
+def search(map_name, processes=1):
+    """
+    :return candidates: threshold name -> [n] values
+    :return scores: [n] predicted score of every candidate
+    """
+    candidates = candidate_grid(map_name)
+    if processes <= 1:
+        return candidates, simulate(map_name, candidates)
+    n = len(next(iter(candidates.values())))
+    chunks = [{name: values[rows] for name, values in candidates.items()}
+              for rows in np.array_split(np.arange(n), processes)]
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        scores = list(executor.map(_simulate_chunk, [(map_name, chunk) for chunk in chunks]))
+    return candidates, np.concatenate(scores)
+
+def best_build_orders(candidates, scores, k=1):
+    """
+    :return build_orders: [(build_order, predicted score)] of the k best candidates, best first
+    """
+    best = np.argsort(-scores, kind="stable")[:k]
+    return [({name: int(values[i]) for name, values in candidates.items()}, float(scores[i])) for i in best]
+
+def play(map_name, build_order, seed=0):
+    """
+    :return score: of one episode of the agent with build_order in minigame_env
+    """
+    env = minigame_env.MiniGameEnv(map_name, seed=seed)
+    agent = getattr(final_agent_lzh, map_name)()
+    agent.build_order = build_order
+    agent.setup(env.observation_spec()[0], env.action_spec()[0])
+    agent.reset()
+    timesteps = env.reset()
+    while not timesteps[0].last():
+        timesteps = env.step([agent.step(timesteps[0])])
+    return int(timesteps[0].observation.score_cumulative[0])
+
+
+def main(unused_argv):
+    results = {}
+    for map_name in FLAGS.maps:
+        candidates, scores = search(map_name, FLAGS.processes)
+        default = getattr(final_agent_lzh, map_name).build_order
+        default_score = simulate(map_name, {name: np.array([value]) for name, value in default.items()})[0]
+        print("%s: %d build orders, default %s predicted %.0f" % (map_name, len(scores), default, default_score))
+        ranked = best_build_orders(candidates, scores, max(1, FLAGS.validate))
+        best, best_played = ranked[0][0], None
+        for build_order, predicted in ranked:
+            line = "    predicted %.0f %s" % (predicted, build_order)
+            if FLAGS.validate:
+                played = play(map_name, build_order, FLAGS.seed)
+                line += " played %d" % played
+                # the model only ranks, the played score picks among the validated ones
+                if best_played is None or played > best_played:
+                    best, best_played = build_order, played
+            print(line)
+        results[map_name] = best
+        print("final_agent_lzh.%s.build_order = %s" % (map_name, best))
+    if FLAGS.output:
+        with open(FLAGS.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    app.run(main)
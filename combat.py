@@ -0,0 +1,181 @@
+"""
+focus fire combat engine for DefeatRoaches and DefeatZerglingsAndBanelings
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Every frame the marine x enemy distance matrix and the enemy health vector are built once with numpy,
+then every marine gets an order:
+    baits (only while banelings are alive): a few marines run at distinct banelings,
+        so the banelings blow up on them instead of on the army, the rest of the army holds position
+    focus fire: enemies are taken in priority order (banelings, then fewest shots to kill, then closest),
+        each gets just enough of its nearest free marines to kill it in one volley, so no shots are wasted on overkill
+Marines sharing an order are commanded together with one select_rect (or select_point) and one Attack_screen.
+
+Usage:
+    engine = combat.FocusFire(bait_cnt=3)
+    action = engine.step(obs)
+"""
+
+import collections
+
+import numpy as np
+from pysc2.lib import actions
+from pysc2.lib import features
+from pysc2.lib import units
+
+from . import tactics
+from . import unit_columns
+
+FUNCTIONS = actions.FUNCTIONS
+
+MARINE_DAMAGE = 6
+MARINE_RANGE = 17.5 # in screen pixels of an 84 x 84 screen
+ARMOR = {units.Zerg.Roach: 1}
+HOLD = -1 # order of marines that hold position
+
+
+class Battle:
+    """
+    marines, enemies and the order of every marine in one observation
+    """
+
+    def __init__(self, feature_units, bait_cnt=0, baits=()):
+        cols = unit_columns.UnitColumns(feature_units)
+        self.marines = np.flatnonzero((cols.alliance == features.PlayerRelative.SELF) &
+                                      (cols.types == units.Terran.Marine))
+        self.enemies = np.flatnonzero(cols.alliance == features.PlayerRelative.ENEMY)
+        self.tags = cols.tags
+        self.xy = cols.xy
+        self.selected = cols.is_selected != 0
+        self.idle = cols.order_length == 0
+
+        enemy_type = cols.types[self.enemies]
+        health = cols.health[self.enemies] + cols.shield[self.enemies]
+        damage = np.full(len(self.enemies), MARINE_DAMAGE)
+        for unit_type, armor in ARMOR.items():
+            damage[enemy_type == unit_type] -= armor
+        self.shots = np.ceil(health / np.maximum(damage, 1)).astype(np.int64) # marines to kill it in one volley
+        self.distances = np.linalg.norm(
+            self.xy[self.marines][:, None, :] - self.xy[self.enemies][None, :, :], axis=2).reshape(
+            len(self.marines), len(self.enemies))
+        self.banelings = enemy_type == units.Zerg.Baneling
+
+        self.orders = np.full(len(self.marines), HOLD) # enemy column of self.enemies, or HOLD
+        free = np.ones(len(self.marines), dtype=bool)
+        self.baits = []
+        if bait_cnt and self.banelings.any():
+            self.baits = self._assign_baits(bait_cnt, baits, free)
+            # the army holds position until the banelings are gone, only shooting at what is in range
+            self._assign_focus_fire(free, reach=MARINE_RANGE)
+        else:
+            self._assign_focus_fire(free)
+
+    def _assign_baits(self, bait_cnt, baits, free):
+        """
+        keep the baits of the last frame, fill up with the marines closest to the banelings,
+        each bait runs at its own baneling
+        :return baits: tags of the baits
+        """
+        banelings = np.flatnonzero(self.banelings)
+        closest = self.distances[:, banelings].min(axis=1)
+        is_bait = np.isin(self.tags[self.marines], list(baits))
+        for m in np.argsort(closest, kind="stable"):
+            if np.count_nonzero(is_bait) >= bait_cnt:
+                break
+            is_bait[m] = True
+        taken = np.zeros(len(self.enemies), dtype=bool)
+        for m in np.flatnonzero(is_bait):
+            candidates = banelings[~taken[banelings]] if not taken[banelings].all() else banelings
+            e = candidates[np.argmin(self.distances[m, candidates])]
+            taken[e] = True
+            self.orders[m] = e
+            free[m] = False
+        return [int(tag) for tag in self.tags[self.marines[is_bait]]]
+
+    def _assign_focus_fire(self, free, reach=None):
+        """
+        :param reach: if given, marines only get enemies closer than this, the others hold
+        """
+        if len(self.enemies) == 0 or not free.any():
+            return
+        distances = self.distances if reach is None else np.where(self.distances <= reach, self.distances, np.inf)
+        priority = np.lexsort((distances[free].min(axis=0), self.shots, ~self.banelings))
+        first = None
+        for e in priority:
+            if not free.any():
+                break
+            candidates = np.flatnonzero(free & np.isfinite(distances[:, e]))
+            if len(candidates) == 0:
+                continue
+            nearest = candidates[np.argsort(distances[candidates, e], kind="stable")[:self.shots[e]]]
+            self.orders[nearest] = e
+            free[nearest] = False
+            first = e if first is None else first
+        # more marines than needed for every enemy, the rest joins the first target
+        if reach is None and first is not None:
+            self.orders[free] = first
+
+    def order_tags(self):
+        """
+        :return tags: tag of the enemy every marine attacks, or HOLD
+        """
+        enemy_tags = np.append(self.tags[self.enemies], HOLD)
+        return enemy_tags[self.orders] # HOLD == -1 picks the appended HOLD
+
+
+class FocusFire:
+    """
+    per env state of the engine: the order last given to every marine and the current baits
+    """
+
+    def __init__(self, bait_cnt=0):
+        self.bait_cnt = bait_cnt
+        self.commanded = {} # marine tag -> enemy tag or HOLD
+        self.baits = []
+
+    def step(self, obs):
+        battle = Battle(obs.observation.feature_units, self.bait_cnt, self.baits)
+        self.baits = battle.baits
+        tags = battle.tags[battle.marines]
+        orders = battle.order_tags().astype(np.int64)
+        idle = battle.idle[battle.marines]
+        commanded = np.array([self.commanded.get(int(tag), HOLD) for tag in tags], dtype=np.int64)
+        stale = commanded != orders
+        # an idle marine holds already, a marine still attacking a live enemy is not called back
+        stale &= ~((orders == HOLD) & (idle | np.isin(commanded, battle.tags[battle.enemies])))
+        # an attacking marine that stopped lost its target
+        stale |= idle & (orders != HOLD)
+        if not stale.any():
+            return FUNCTIONS.no_op()
+
+        # the selected marines are waiting for their order
+        selected = battle.selected[battle.marines]
+        if (selected & stale).any():
+            order = collections.Counter(orders[selected & stale].tolist()).most_common(1)[0][0]
+            action = self._command(obs, battle, order)
+            if action is not None:
+                for tag in tags[selected]:
+                    self.commanded[int(tag)] = order
+                return action
+
+        # select the largest group of marines sharing a stale order
+        order = collections.Counter(orders[stale].tolist()).most_common(1)[0][0]
+        group = np.flatnonzero(stale & (orders == order))
+        xy = battle.xy[battle.marines]
+        lo, hi = xy[group].min(axis=0) - 1, xy[group].max(axis=0) + 1
+        inside = np.all((xy >= lo) & (xy <= hi), axis=1)
+        if np.array_equal(np.flatnonzero(inside), group):
+            return FUNCTIONS.select_rect("select", tactics.make_save_pos(obs, lo.tolist()),
+                                         tactics.make_save_pos(obs, hi.tolist()))
+        return FUNCTIONS.select_point("select", xy[group[0]].tolist())
+
+    @staticmethod
+    def _command(obs, battle, order):
+        available = obs.observation.available_actions
+        if order == HOLD:
+            return FUNCTIONS.HoldPosition_quick("now") if FUNCTIONS.HoldPosition_quick.id in available else None
+        if FUNCTIONS.Attack_screen.id not in available:
+            return None
+        e = int(np.flatnonzero(battle.tags[battle.enemies] == order)[0])
+        return FUNCTIONS.Attack_screen("now", battle.xy[battle.enemies[e]].tolist())
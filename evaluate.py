@@ -0,0 +1,154 @@
+"""
+parallel evaluation of the agents, aggregated like the Results tables of the README
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Episodes of every agent are fanned out over a process pool. Every worker keeps one env and one agent
+(for the agent and map of its last episode), so a real game is only started again when the worker
+switches to another map. Scores (the sum of rewards of an episode, the minigame score) are streamed
+back as episodes finish, then mean / std / max of every agent are printed as a README table row.
+    --env minigame: minigame_env.MiniGameEnv, reseeded with --seed + n before episode n whichever worker
+        plays it, so scores don't depend on --processes
+    --env sc2: pysc2.env.sc2_env.SC2Env, needs StarCraft II and the minigame maps, the game only takes
+        a seed at launch: a worker's game is seeded with --seed + n of the first episode it plays and its later
+        episodes are restarts of it, so scores are reproducible only for the same --processes
+
+Usage:
+    python -m pysc2.agents.evaluate --episodes 100 --output scores.jsonl
+    python -m pysc2.agents.evaluate --env sc2 --agents BuildMarines --episodes 10 --processes 4
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+from absl import app
+from absl import flags
+
+from . import final_agent_lzh
+from . import minigame_env
+
+FLAGS = flags.FLAGS
+flags.DEFINE_list("agents", list(minigame_env.MAPS), "Agents in final_agent_lzh to evaluate, on the map of the same name.")
+flags.DEFINE_integer("episodes", 10, "Episodes per agent.")
+flags.DEFINE_integer("processes", os.cpu_count(), "Worker processes, each runs one env.")
+flags.DEFINE_enum("env", "minigame", ["minigame", "sc2"], "Stand-in environment or StarCraft II.")
+flags.DEFINE_integer("step_mul", 8, "Game steps per agent step.")
+flags.DEFINE_integer("screen_size", 84, "Resolution of the feature screen.")
+flags.DEFINE_integer("seed", 0, "Seed of episode 0, episode n is seeded with seed + n (see above for sc2).")
+flags.DEFINE_string("output", None, "Append every episode as a json line to this file.")
+
+# env and agent of this worker process
+_worker = {"key": None, "env": None, "agent": None}
+
+
+def make_env(env_name, map_name, step_mul=8, screen_size=84, seed=None, step_latency=0.):
+    if env_name == "minigame":
+        return minigame_env.MiniGameEnv(map_name, seed=seed, step_mul=step_mul, screen_size=screen_size,
+                                        step_latency=step_latency)
+    from pysc2.env import sc2_env
+    from pysc2.lib import features
+    return sc2_env.SC2Env(
+        map_name=map_name,
+        random_seed=seed,
+        players=[sc2_env.Agent(sc2_env.Race.terran)],
+        agent_interface_format=features.AgentInterfaceFormat(
+            feature_dimensions=features.Dimensions(screen=screen_size, minimap=64),
+            use_feature_units=True),
+        step_mul=step_mul,
+        visualize=False)
+
+def _init_worker():
+    # SC2Env reads pysc2's flags, the pool workers never parse a command line
+    if not FLAGS.is_parsed():
+        FLAGS.mark_as_parsed()
+
+def run_episode(agent_name, map_name, episode, env_name="minigame", step_mul=8, screen_size=84, seed=0):
+    """
+    play one episode in the env of this worker, which is made on first use and kept for the next episodes,
+    a stand-in env is reseeded with seed + episode, StarCraft II keeps the seed it was launched with
+    :return result: dict of agent, map, episode, score, steps, seconds, pid
+    """
+    key = (agent_name, map_name, env_name, step_mul, screen_size)
+    if _worker["key"] != key:
+        if _worker["env"] is not None:
+            _worker["env"].close()
+        env = make_env(env_name, map_name, step_mul, screen_size, seed + episode)
+        agent = getattr(final_agent_lzh, agent_name)()
+        agent.setup(env.observation_spec()[0], env.action_spec()[0])
+        _worker.update(key=key, env=env, agent=agent)
+    env, agent = _worker["env"], _worker["agent"]
+    if env_name == "minigame":
+        env.seed(seed + episode)
+
+    start = time.time()
+    agent.reset()
+    timesteps = env.reset()
+    score, steps = 0., 0
+    while True:
+        action = agent.step(timesteps[0])
+        if timesteps[0].last():
+            break
+        timesteps = env.step([action])
+        score += timesteps[0].reward
+        steps += 1
+    return {"agent": agent_name, "map": map_name, "episode": episode, "score": float(score), "steps": steps,
+            "seconds": time.time() - start, "pid": os.getpid()}
+
+def evaluate(agent_names, episodes, processes=None, env_name="minigame", step_mul=8, screen_size=84, seed=0,
+             callback=None):
+    """
+    :param callback: called with the result of every episode, as soon as it finished
+    :return scores: agent name -> [episodes] scores, in episode order
+    """
+    scores = {name: [None] * episodes for name in agent_names}
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker) as executor:
+        futures = [executor.submit(run_episode, name, name, episode, env_name, step_mul, screen_size, seed)
+                   for name in agent_names for episode in range(episodes)]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            scores[result["agent"]][result["episode"]] = result["score"]
+            if callback:
+                callback(result)
+    return scores
+
+def aggregate(scores):
+    """
+    :return stats: mean, std and max of scores
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    return collections.OrderedDict([("mean", scores.mean()), ("std", scores.std()), ("max", scores.max())])
+
+def table_row(stats):
+    return "| __Ours__ | %.0f | %.0f | %.0f |" % (stats["mean"], stats["std"], stats["max"])
+
+
+def main(unused_argv):
+    output = open(FLAGS.output, "a") if FLAGS.output else None
+
+    def report(result):
+        print("%s episode %d: %.0f (%d steps, %.1fs, pid %d)" % (
+            result["agent"], result["episode"], result["score"], result["steps"], result["seconds"], result["pid"]))
+        if output:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+
+    try:
+        scores = evaluate(FLAGS.agents, FLAGS.episodes, FLAGS.processes, FLAGS.env, FLAGS.step_mul,
+                          FLAGS.screen_size, FLAGS.seed, callback=report)
+    finally:
+        if output:
+            output.close()
+    for name in FLAGS.agents:
+        print("- %s (%d episodes)" % (name, FLAGS.episodes))
+        print("    |  | Mean | Std | Max |")
+        print("    | --- | ---: | --- | --- |")
+        print("    " + table_row(aggregate(scores[name])))
+
+
+if __name__ == "__main__":
+    app.run(main)
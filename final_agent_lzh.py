@@ -12,51 +12,275 @@ from pysc2.lib import features
 from pysc2.lib import units
 FUNCTIONS = actions.FUNCTIONS
 
+from . import combat
+from . import shards
 from . import tactics
+from . import unit_columns
 
 # base tactic agent
 class TacticAgent(base_agent.BaseAgent):
+    recorder = None # recording.ObservationRecorder, if set every observation is recorded
+    memoize_checks = True # cache tactic checks until the quantities they depend on change
+    cache_selection = True # skip the select step when the executer is already selected, keep buildings in control groups
+    fall_through = True # if the chosen tactic would send a no_op, go on with the next tactic in the same step
+    profiler = None # profiling.TacticProfiler, if set every tactic check / select / exec is timed and counted
+    plan_commands = True # send the rest of the actions a tactic planned (e.g. queued trains) on the next steps
+    tracer = None # tracing.DecisionTracer, if set the decision of every step is kept in a ring buffer per env
+
     def setup(self, obs_spec, action_spec):
         super(TacticAgent, self).setup(obs_spec, action_spec)
         if "feature_units" not in obs_spec:
             raise Exception("This agent requires the feature_units observation.")
-        self.possible_tactic_list = [
-            tactics.tactic_no_op
-        ]
+        self.set_possible_tactic_list([
+            (tactics.tactic_no_op, None)
+        ])
+
+    def set_possible_tactic_list(self, possible_tactic_list_and_additional_check):
+        """
+        :param possible_tactic_list_and_additional_check:
+            list of (tactic, additional_func) or (tactic, additional_func, depends_on),
+            depends_on lists the quantities additional_func reads, see tactics.get_quantity
+        """
+        self.possible_tactic_list = []
+        for tactic, additional_func, *depends_on in possible_tactic_list_and_additional_check:
+            self.possible_tactic_list.append(tactic.instantiate(additional_func, *depends_on))
 
     def reset(self):
         super(TacticAgent, self).reset()
-        self.select_new_tactic = True # if True: select tactic, else: exec the selected tactic
-        self.tactic_idx = 0
+        self.reset_envs(1)
 
-        # renew 
+    # per env state, step() uses env 0, step_batch() one env per observation
+    def reset_envs(self, n_envs):
+        self.select_new_tactic = np.ones(n_envs, dtype=bool) # if True: select tactic, else: exec the selected tactic
+        self.tactic_idx = np.zeros(n_envs, dtype=np.int32)
+        self.frame_tactic = np.full(n_envs, -1, dtype=np.int32) # tactic the last frame went to, -1 if none was executable
+
+        # renew, tactics assigned directly to possible_tactic_list get their own instance here
         for idx, tactic in enumerate(self.possible_tactic_list):
+            if isinstance(tactic, tactics.Tactic):
+                tactic = tactic.instantiate()
             tactic.execed = False
             self.possible_tactic_list[idx] = tactic
+        self.env_tactics = [self.possible_tactic_list] + \
+                           [[tactic.copy() for tactic in self.possible_tactic_list] for _ in range(n_envs - 1)]
+
+        self.env_states = [tactics.EnvState() for _ in range(n_envs)] # passed to exec_func
+        self.wasted_frames = np.zeros(n_envs, dtype=np.int64) # frames a tactic other than tactic_no_op sent a no_op, this episode
+        self.failed_tactics = np.zeros(n_envs, dtype=np.int64) # tactics fall_through passed over as they gave a no_op, this episode
+        self.first_obs = [None] * n_envs
+        self._check_cache = [{} for _ in range(n_envs)] # tactic idx -> (values of the quantities it depends on, check result)
+        self.plans = [[] for _ in range(n_envs)] # actions left of the plan of the current tactic
+        if self.profiler is not None:
+            self.profiler.attach(self)
+        if self.tracer is not None:
+            self.tracer.reset_envs(n_envs, [tactic.tactic.name for tactic in self.possible_tactic_list])
 
-        self.first_obs = None
+    def reset_env(self, i):
+        self.select_new_tactic[i] = True
+        self.tactic_idx[i] = 0
+        self.frame_tactic[i] = -1
+        for tactic in self.env_tactics[i]:
+            tactic.execed = False
+        self.wasted_frames[i] = 0
+        self.failed_tactics[i] = 0
+        self.env_states[i] = tactics.EnvState()
+        self.first_obs[i] = None
+        self._check_cache[i] = {}
+        self.plans[i] = []
+        if self.tracer is not None:
+            self.tracer.start_episode(i)
+
+    def check_tactic(self, idx, obs, quantities, i=0):
+        """
+        check_tactic_executable of possible_tactic_list[idx], answered from the cache of env i if possible
+        :param quantities: dict of quantities already read from this obs, shared by all checks of a step
+        """
+        tactic = self.env_tactics[i][idx]
+        depends_on = tactic.check_depends_on() if self.memoize_checks else None
+        if depends_on is None:
+            return tactic.check_tactic_executable(obs)
+        for key in depends_on:
+            if key not in quantities:
+                quantities[key] = tactics.get_quantity(obs, key)
+        values = tuple(quantities[key] for key in depends_on)
+        cached = self._check_cache[i].get(idx)
+        if cached is not None and cached[0] == values:
+            return cached[1]
+        executable = bool(tactic.check_tactic_executable(obs))
+        self._check_cache[i][idx] = (values, executable)
+        return executable
 
     def step(self, obs):
         super(TacticAgent, self).step(obs)
-        if not self.first_obs:
-            self.first_obs = obs
+        if self.recorder:
+            self.recorder.record(obs)
+        return self.step_env(0, obs)
+
+    def step_batch(self, obs_list):
+        """
+        step many envs at once, one observation per env, always in the same env order
+        :return actions: one action per env
+        """
+        if len(getattr(self, "first_obs", [])) != len(obs_list):
+            self.reset_envs(len(obs_list))
+        for i, obs in enumerate(obs_list):
+            super(TacticAgent, self).step(obs)
+            if self.recorder:
+                self.recorder.record(obs, i)
+            if obs.first() and self.first_obs[i] is not None:
+                self.reset_env(i)
+        tactics.index_units_batch(obs_list)
+        return [self.step_env(i, obs) for i, obs in enumerate(obs_list)]
+
+    def select_executer(self, tactic, obs):
+        """
+        :return action: the select step of tactic, None if its executer is already selected
+        """
+        executer = tactic.tactic.executer
+        if not self.cache_selection or executer is None:
+            return tactic.select_executer_func(obs)
+        if tactics.executer_selected(obs, executer):
+            return None
+        if executer.group is not None and tactics.get_unit_cnt(obs, executer.unit_type) > 0:
+            if tactics.control_group_current(obs, executer):
+                return FUNCTIONS.select_control_group("recall", executer.group)
+            # select all of them, the control group is set from this selection on a spare frame
+            pos = tactics.get_unit_index(obs).first(executer.unit_type)
+            return FUNCTIONS.select_point("select_all_type", tactics.make_save_pos(obs, pos))
+        return tactic.select_executer_func(obs)
+
+    def set_control_group(self, i, obs):
+        """
+        :return action: set a stale control group if all units of its type are selected, else None
+        """
+        for tactic in self.env_tactics[i]:
+            executer = tactic.tactic.executer
+            if executer is None or executer.group is None or "control_groups" not in obs.observation:
+                continue
+            if not tactics.control_group_current(obs, executer) and \
+                    tactics.executer_selected(obs, executer._replace(all_units=True)):
+                return FUNCTIONS.select_control_group("set", executer.group)
+        return None
+
+    def fill_no_op(self, i, obs, action):
+        # spend frames that would be a no_op on control group bookkeeping
+        if self.cache_selection and action.function == FUNCTIONS.no_op.id:
+            return self.set_control_group(i, obs) or action
+        return action
+
+    def exec_tactic(self, i, tactic, obs):
+        """
+        :return action: the exec action of tactic, the rest of its plan is kept in plans[i]
+        """
+        action = tactic.exec_func(obs, self.env_states[i])
+        if isinstance(action, list):
+            action, plan = action[0], action[1:]
+            if self.plan_commands:
+                self.plans[i] = plan
+        return action
+
+    def next_planned(self, i, obs):
+        """
+        :return action: the next action of the plan of env i, None if there is none or it can't be sent
+        """
+        action = self.plans[i].pop(0)
+        executer = self.env_tactics[i][self.tactic_idx[i]].tactic.executer
+        if action.function not in obs.observation.available_actions or \
+                executer is not None and not tactics.executer_selected(obs, executer):
+            self.plans[i] = []
+            return None
+        return action
+
+    def preempted(self, i, obs, quantities):
+        """
+        check if a tactic before the current one in possible_tactic_list became executable,
+        once-tactics are skipped, as checking them uses them up
+        """
+        for idx in range(self.tactic_idx[i]):
+            if not self.env_tactics[i][idx].tactic.once and self.check_tactic(idx, obs, quantities, i):
+                return True
+        return False
+
+    @staticmethod
+    def is_wasted(tactic, action):
+        return action.function == FUNCTIONS.no_op.id and tactic.tactic is not tactics.tactic_no_op
+
+    def start_tactic(self, i, obs, start, quantities):
+        """
+        choose the first executable tactic from possible_tactic_list[start:] and return its first action,
+        with fall_through, tactics whose action would be a no_op are passed over
+        :return action: None if no tactic gives an action
+        """
+        for idx in range(start, len(self.env_tactics[i])):
+            if not self.check_tactic(idx, obs, quantities, i):
+                continue
+            tactic = self.env_tactics[i][idx]
+            action = self.select_executer(tactic, obs)
+            select_new_tactic = action is None
+            if select_new_tactic:
+                # executer already selected, exec right away
+                action = self.exec_tactic(i, tactic, obs)
+            if not self.fall_through or not self.is_wasted(tactic, action):
+                self.tactic_idx[i] = idx
+                self.select_new_tactic[i] = select_new_tactic
+                return action
+            self.failed_tactics[i] += 1
+        return None
+
+    def step_env(self, i, obs):
+        if not self.first_obs[i]:
+            self.first_obs[i] = obs
+
+        quantities = {}
+        # go on with the plan of the current tactic, drop it once a tactic before it became executable
+        action = None
+        if self.plans[i]:
+            if self.preempted(i, obs, quantities):
+                self.plans[i] = []
+                self.select_new_tactic[i] = True
+            else:
+                action = self.next_planned(i, obs)
+        phase = tactics.PHASE_PLAN
 
         # select new tactic, and click on executer
-        if self.select_new_tactic:
-            self.select_new_tactic = False
-            for idx, tactic in enumerate(self.possible_tactic_list):
-                if tactic.check_tactic_executable(obs):
-                    self.tactic_idx = idx
-                    break
-            return self.possible_tactic_list[self.tactic_idx].select_executer_func(obs)
+        if action is None and self.select_new_tactic[i]:
+            action = self.start_tactic(i, obs, 0, quantities)
+            phase = tactics.PHASE_EXEC if self.select_new_tactic[i] else tactics.PHASE_SELECT
+            if action is None:
+                action = FUNCTIONS.no_op()
+                phase = tactics.PHASE_NO_TACTIC
 
         # in command, exec
-        else:
-            self.select_new_tactic = True
-            return self.possible_tactic_list[self.tactic_idx].exec_func(obs)
+        elif action is None:
+            self.select_new_tactic[i] = True
+            action = self.exec_tactic(i, self.env_tactics[i][self.tactic_idx[i]], obs)
+            phase = tactics.PHASE_EXEC
+            if self.fall_through and self.is_wasted(self.env_tactics[i][self.tactic_idx[i]], action):
+                # e.g. the selection failed, the frame goes to the next tactic instead
+                self.failed_tactics[i] += 1
+                next_action = self.start_tactic(i, obs, self.tactic_idx[i] + 1, {})
+                if next_action is not None:
+                    action, phase = next_action, tactics.PHASE_FALL_THROUGH
+
+        # tactic_idx still points at the tactic before if none was executable
+        frame_tactic = -1 if phase == tactics.PHASE_NO_TACTIC else self.tactic_idx[i]
+        self.frame_tactic[i] = frame_tactic
+        filled = self.fill_no_op(i, obs, action)
+        if filled is not action:
+            action, phase = filled, tactics.PHASE_CONTROL_GROUP
+        wasted = frame_tactic >= 0 and self.is_wasted(self.env_tactics[i][frame_tactic], action)
+        if wasted:
+            self.wasted_frames[i] += 1
+        if self.tracer is not None:
+            self.tracer.record(i, obs, frame_tactic, phase, action, wasted)
+        return action
 
 
 class CollectMineralShards(base_agent.BaseAgent):
+    recorder = None # recording.ObservationRecorder, if set every observation is recorded
+    plan_commands = True # queue the next shards of a marine's route as waypoints, instead of one move per shard
+    plan_length = 3 # waypoints queued per marine
+
     def setup(self, obs_spec, action_spec):
         super(CollectMineralShards, self).setup(obs_spec, action_spec)
         if "feature_units" not in obs_spec:
@@ -64,112 +288,236 @@ class CollectMineralShards(base_agent.BaseAgent):
 
     def reset(self):
         super(CollectMineralShards, self).reset()
-        self._marine_selected = False
-        self._previous_mineral_xy = [-1, -1]
+        self.reset_envs(1)
+
+    # per env state, step() uses env 0, step_batch() one env per observation
+    def reset_envs(self, n_envs):
+        self._routes = [shards.ShardRoutes() for _ in range(n_envs)]
+        self._started = np.zeros(n_envs, dtype=bool)
+
+    def reset_env(self, i):
+        self._routes[i] = shards.ShardRoutes()
 
     def step(self, obs):
         super(CollectMineralShards, self).step(obs)
-        marines = [unit for unit in obs.observation.feature_units if unit.alliance == features.PlayerRelative.SELF]
-        if not marines:
+        if self.recorder:
+            self.recorder.record(obs)
+        return self.step_envs([obs])[0]
+
+    def step_batch(self, obs_list):
+        """
+        step many envs at once, one observation per env, always in the same env order
+        :return actions: one action per env
+        """
+        if len(getattr(self, "_routes", [])) != len(obs_list):
+            self.reset_envs(len(obs_list))
+        for i, obs in enumerate(obs_list):
+            super(CollectMineralShards, self).step(obs)
+            if self.recorder:
+                self.recorder.record(obs, i)
+            if obs.first() and self._started[i]:
+                self.reset_env(i)
+        return self.step_envs(obs_list)
+
+    def step_envs(self, obs_list):
+        """
+        split the stacked feature_units of all envs into marines and shards, and follow the routes of each env
+        """
+        self._started[:] = True
+        fu, env, offsets = tactics.stack_feature_units([obs.observation.feature_units for obs in obs_list])
+        cols = unit_columns.UnitColumns(fu)
+        own = cols.alliance == features.PlayerRelative.SELF
+        neutral = cols.alliance == features.PlayerRelative.NEUTRAL
+
+        actions = []
+        for i, obs in enumerate(obs_list):
+            rows = slice(offsets[i], offsets[i + 1])
+            marines = offsets[i] + np.flatnonzero(own[rows])
+            minerals = offsets[i] + np.flatnonzero(neutral[rows])
+            self._routes[i].update(cols.tags[marines], cols.xy[marines], cols.tags[minerals], cols.xy[minerals])
+            if self.plan_commands:
+                actions.append(self._plan_action(i, obs, marines, cols))
+            else:
+                actions.append(self._action(i, obs, marines, cols))
+        return actions
+
+    def _plan_action(self, i, obs, marines, cols):
+        """
+        send a marine that is stale to the next shard of its route, else queue the next shard
+        on a marine with less than plan_length waypoints, a marine already selected goes first
+        unless another one is stale
+        """
+        routes = self._routes[i]
+        waiting = [] # (not stale, waypoints queued, tag, marine, shard slot)
+        for marine, tag, order_length in zip(marines.tolist(), cols.tags[marines].tolist(),
+                                             cols.order_length[marines].tolist()):
+            stale = routes.sync_queue(tag, order_length)
+            if stale:
+                target = routes.target(tag, cols.xy[marine])
+            elif len(routes.queued[tag]) < self.plan_length:
+                target = routes.next_waypoint(tag)
+            else:
+                target = None
+            if target is not None:
+                waiting.append((not stale, len(routes.queued[tag]), tag, marine, target))
+        if not waiting:
+            return FUNCTIONS.no_op()
+
+        waiting.sort(key=lambda w: w[:2])
+        selected = marines[cols.is_selected[marines] != 0].tolist()
+        for queued, _, tag, marine, target in waiting:
+            if selected == [marine] and (not queued or waiting[0][0]) and \
+                    FUNCTIONS.Move_screen.id in obs.observation.available_actions:
+                if queued:
+                    routes.queued[tag].append(target)
+                else:
+                    routes.queued[tag] = [target]
+                return FUNCTIONS.Move_screen("queued" if queued else "now", routes.index.pos(target))
+        return FUNCTIONS.select_point("select", cols.pos(waiting[0][3]))
+
+    def _action(self, i, obs, marines, cols):
+        """
+        give the next shard of its route to a marine whose target changed or that stopped,
+        a marine already selected goes first, as it needs no select step
+        """
+        routes = self._routes[i]
+        waiting = []
+        for marine, tag, order_length in zip(marines.tolist(), cols.tags[marines].tolist(),
+                                             cols.order_length[marines].tolist()):
+            target = routes.target(tag, cols.xy[marine])
+            if target is not None and (routes.sent.get(tag) != target or order_length == 0):
+                waiting.append((tag, marine, target))
+        if not waiting:
             return FUNCTIONS.no_op()
-        marine_unit = next((m for m in marines if m.is_selected == self._marine_selected), marines[0])
-        marine_xy = [marine_unit.x, marine_unit.y]
-
-        if not marine_unit.is_selected:
-            self._marine_selected = True
-            return FUNCTIONS.select_point("select", marine_xy)
-        if FUNCTIONS.Move_screen.id in obs.observation.available_actions:
-            minerals = [[unit.x, unit.y] for unit in obs.observation.feature_units if unit.alliance == features.PlayerRelative.NEUTRAL]
-            if self._previous_mineral_xy in minerals:
-                minerals.remove(self._previous_mineral_xy)
-            if minerals:
-                distances = np.linalg.norm(np.array(minerals) - np.array(marine_xy), axis=1)
-                closest_mineral_xy = minerals[np.argmin(distances)]
-                self._marine_selected = False
-                self._previous_mineral_xy = closest_mineral_xy
-                return FUNCTIONS.Move_screen("now", closest_mineral_xy)
-        return FUNCTIONS.no_op()
+
+        selected = marines[cols.is_selected[marines] != 0].tolist()
+        for tag, marine, target in waiting:
+            if selected == [marine] and FUNCTIONS.Move_screen.id in obs.observation.available_actions:
+                routes.sent[tag] = target
+                return FUNCTIONS.Move_screen("now", routes.index.pos(target))
+        return FUNCTIONS.select_point("select", cols.pos(waiting[0][1]))
 
 
 class CollectMineralsAndGas(TacticAgent):
+    # thresholds of the tactic checks, see buildorder.py to search them
+    build_order = {"command_centers": 2, "supply_depots": 3, "refineries": 2, "refinery_scvs": 16}
+
     def setup(self, obs_spec, action_spec):
         super(CollectMineralsAndGas, self).setup(obs_spec, action_spec)
+        order = self.build_order
         possible_tactic_list_and_additional_check = [
             (tactics.tactic_build_command_center,
-             lambda obs: tactics.get_unit_cnt(obs, units.Terran.CommandCenter) <= 1),
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.CommandCenter) < order["command_centers"],
+             (units.Terran.CommandCenter,)),
             (tactics.tactic_build_supply_depot,
-             lambda obs: tactics.get_unit_cnt(obs, units.Terran.SupplyDepot) < 3 and \
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.SupplyDepot) < order["supply_depots"] and \
                          tactics.get_unit_cnt(obs, units.Terran.CommandCenter) >= 2 and \
-                         tactics.food_cap_equal_used(obs)),
+                         tactics.food_cap_equal_used(obs),
+             (units.Terran.SupplyDepot, units.Terran.CommandCenter, "food_cap", "food_used")),
+            (tactics.tactic_build_refinery,
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.Refinery) < order["refineries"] and \
+                         tactics.get_unit_cnt(obs, units.Terran.SCV) >= order["refinery_scvs"],
+             (units.Terran.Refinery, units.Terran.SCV)),
             (tactics.tactic_harvest_mineral, None),
             (tactics.tactic_train_scv, None),
             (tactics.tactic_no_op, None) # the last one should be tactic_no_op, if no above tactic executable
         ]
-        self.possible_tactic_list = []
-        for tactic, additional_func in possible_tactic_list_and_additional_check:
-            if additional_func:
-                tactic.add_additional_check_tactic_executable(additional_func)
-            self.possible_tactic_list.append(tactic)
+        self.set_possible_tactic_list(possible_tactic_list_and_additional_check)
 
 
 class BuildMarines(TacticAgent):
+    # thresholds of the tactic checks, see buildorder.py to search them
+    # supply_margin: build supply depot once food_cap - food_used <= supply_margin
+    build_order = {"barracks": 7, "scvs": 20, "supply_depots": 25, "supply_margin": 0}
+
     def setup(self, obs_spec, action_spec):
         super(BuildMarines, self).setup(obs_spec, action_spec)
+        order = self.build_order
         
         # score = 132
         possible_tactic_list_and_additional_check = [
             (tactics.tactic_harvest_mineral, None),
             # building tactics should be placed higher place
             (tactics.tactic_build_supply_depot,
-             lambda obs: tactics.food_cap_equal_used(obs)),
+             lambda obs: tactics.get_quantity(obs, "food_cap") - tactics.get_quantity(obs, "food_used") <= \
+                         order["supply_margin"] and \
+                         tactics.get_unit_cnt(obs, units.Terran.SupplyDepot) < order["supply_depots"],
+             ("food_cap", "food_used", units.Terran.SupplyDepot)),
             (tactics.tactic_build_barracks,
-             lambda obs: tactics.get_unit_cnt(obs, units.Terran.Barracks) < 7),
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.Barracks) < order["barracks"],
+             (units.Terran.Barracks,)),
             (tactics.tactic_train_marine,
-             lambda obs: tactics.get_unit_cnt(obs, units.Terran.Barracks) >= 7),
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.Barracks) >= order["barracks"],
+             (units.Terran.Barracks,)),
             (tactics.tactic_train_scv,
-             lambda obs: tactics.get_unit_cnt(obs, units.Terran.SCV) < 20),
+             lambda obs: tactics.get_unit_cnt(obs, units.Terran.SCV) < order["scvs"],
+             (units.Terran.SCV,)),
             (tactics.tactic_no_op, None) # the last one should be tactic_no_op, if no above tactic executable
         ]
+        self.set_possible_tactic_list(possible_tactic_list_and_additional_check)
 
-        self.possible_tactic_list = []
-        for tactic, additional_func in possible_tactic_list_and_additional_check:
-            if additional_func:
-                tactic.add_additional_check_tactic_executable(additional_func)
-            self.possible_tactic_list.append(tactic)
 
+# base agent of the combat minigames, marines are commanded by combat.FocusFire
+class CombatAgent(base_agent.BaseAgent):
+    recorder = None # recording.ObservationRecorder, if set every observation is recorded
+    tracer = None # tracing.DecisionTracer, the engine is traced as tactic 0, phases from the functions sent
+    bait_cnt = 0 # marines sent at the banelings while there are any
 
-class DefeatZerglingsAndBanelings(TacticAgent):
     def setup(self, obs_spec, action_spec):
-        super(DefeatZerglingsAndBanelings, self).setup(obs_spec, action_spec)
+        super(CombatAgent, self).setup(obs_spec, action_spec)
+        if "feature_units" not in obs_spec:
+            raise Exception("This agent requires the feature_units observation.")
 
-        possible_tactic_list_and_additional_check = [
-            (tactics.tactic_attack_zerg_pioneer,
-             lambda obs: tactics.get_unit_cnt(obs, units.Zerg.Baneling) > 0 and \
-                         tactics.get_busy_marine_cnt(obs) <= 3),
-            (tactics.tactic_attack_zerg_all,
-             lambda obs: tactics.get_unit_cnt(obs, units.Zerg.Baneling) <= 2),
-            (tactics.tactic_no_op, None) # the last one should be tactic_no_op, if no above tactic executable
-        ]
+    def reset(self):
+        super(CombatAgent, self).reset()
+        self.reset_envs(1)
 
-        self.possible_tactic_list = []
-        for tactic, additional_func in possible_tactic_list_and_additional_check:
-            if additional_func:
-                tactic.add_additional_check_tactic_executable(additional_func)
-            self.possible_tactic_list.append(tactic)
+    # per env state, step() uses env 0, step_batch() one env per observation
+    def reset_envs(self, n_envs):
+        self._engines = [combat.FocusFire(self.bait_cnt) for _ in range(n_envs)]
+        self._started = np.zeros(n_envs, dtype=bool)
+        if self.tracer is not None:
+            self.tracer.reset_envs(n_envs, ["focus_fire"])
 
+    def reset_env(self, i):
+        self._engines[i] = combat.FocusFire(self.bait_cnt)
+        if self.tracer is not None:
+            self.tracer.start_episode(i)
 
-class DefeatRoaches(TacticAgent):
-    def setup(self, obs_spec, action_spec):
-        super(DefeatRoaches, self).setup(obs_spec, action_spec)
+    def step_engine(self, i, obs):
+        action = self._engines[i].step(obs)
+        if self.tracer is not None:
+            phase = tactics.action_phase(action)
+            self.tracer.record(i, obs, -1 if phase == tactics.PHASE_NO_TACTIC else 0, phase, action, False)
+        return action
 
-        possible_tactic_list_and_additional_check = [
-            (tactics.tactic_attack_all, None),
-            (tactics.tactic_no_op, None) # the last one should be tactic_no_op, if no above tactic executable
-        ]
+    def step(self, obs):
+        super(CombatAgent, self).step(obs)
+        if self.recorder:
+            self.recorder.record(obs)
+        self._started[0] = True
+        return self.step_engine(0, obs)
+
+    def step_batch(self, obs_list):
+        """
+        step many envs at once, one observation per env, always in the same env order
+        :return actions: one action per env
+        """
+        if len(getattr(self, "_engines", [])) != len(obs_list):
+            self.reset_envs(len(obs_list))
+        for i, obs in enumerate(obs_list):
+            super(CombatAgent, self).step(obs)
+            if self.recorder:
+                self.recorder.record(obs, i)
+            if obs.first() and self._started[i]:
+                self.reset_env(i)
+        self._started[:] = True
+        return [self.step_engine(i, obs) for i, obs in enumerate(obs_list)]
+
+
+class DefeatZerglingsAndBanelings(CombatAgent):
+    bait_cnt = 1 # pioneer the banelings explode on, a new one is picked when it dies
 
-        self.possible_tactic_list = []
-        for tactic, additional_func in possible_tactic_list_and_additional_check:
-            if additional_func:
-                tactic.add_additional_check_tactic_executable(additional_func)
-            self.possible_tactic_list.append(tactic)
 
+class DefeatRoaches(CombatAgent):
+    pass
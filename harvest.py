@@ -0,0 +1,103 @@
+"""
+load balancer of harvesting SCVs over mineral fields and refineries
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Every resource (mineral field with minerals left, own finished refinery) belongs to its nearest
+CommandCenter within BASE_RANGE. The load of a resource is the number of SCVs sent to it,
+tracked across steps (an SCV counts until it goes idle or dies), or assigned_harvesters
+of feature_units if that is higher. An idle SCV is sent to the least saturated
+(load / ideal harvesters) resource of its nearest base, the nearest one among equals;
+once its base is saturated, to the least saturated resource of any base.
+
+Usage:
+    harvest = Harvest()
+    pos = harvest.target(obs, scv) # scv: row of the SCV in feature_units, [x, y] or None
+"""
+
+import collections
+
+import numpy as np
+from pysc2.lib import features
+from pysc2.lib import units
+
+from . import unit_columns
+
+IDEAL = 2 # harvesters per mineral field
+IDEAL_REFINERY = 3
+BASE_RANGE = 35 # resources this close to a CommandCenter are harvested from it
+
+MINERAL_FIELDS = frozenset(unit_type for unit_type in units.Neutral if "MineralField" in unit_type.name)
+
+
+class Harvest:
+    """
+    resource every SCV of one env was sent to
+    """
+
+    def __init__(self):
+        self.assigned = {} # scv tag -> resource tag
+
+    def _sync(self, cols):
+        """
+        forget SCVs that went idle or died, and resources that are gone
+        """
+        busy = set(cols.tags[(cols.types == units.Terran.SCV) & (cols.order_length > 0)].tolist())
+        present = set(cols.tags.tolist())
+        self.assigned = {scv: resource for scv, resource in self.assigned.items()
+                         if scv in busy and resource in present}
+
+    def resources(self, cols):
+        """
+        :param cols: UnitColumns of feature_units
+        :return rows: rows of feature_units that can be harvested
+        :return ideal: ideal number of harvesters of each
+        """
+        minerals = np.isin(cols.types, list(MINERAL_FIELDS)) & (cols.mineral_contents > 0)
+        refineries = (cols.types == units.Terran.Refinery) & \
+                     (cols.alliance == features.PlayerRelative.SELF) & (cols.build_progress >= 100)
+        rows = np.flatnonzero(minerals | refineries)
+        ideal = np.where(refineries[rows], IDEAL_REFINERY, IDEAL)
+        return rows, ideal
+
+    def load(self, cols, rows):
+        """
+        :return load: harvesters of every resource in rows
+        """
+        tracked = collections.Counter(self.assigned.values())
+        load = np.array([tracked.get(tag, 0) for tag in cols.tags[rows].tolist()], dtype=np.int64)
+        return np.maximum(load, cols.assigned_harvesters[rows])
+
+    def target(self, obs, scv):
+        """
+        :param scv: row of the SCV to send in feature_units
+        :return pos: [x, y] of the resource it is sent to, if no, return None
+        """
+        cols = unit_columns.UnitColumns(obs.observation.feature_units)
+        self._sync(cols)
+        scv_tag = int(cols.tags[scv])
+        self.assigned.pop(scv_tag, None)
+        rows, ideal = self.resources(cols)
+        if len(rows) == 0:
+            return None
+        xy = cols.xy.astype(np.float64)
+        bases = np.flatnonzero((cols.types == units.Terran.CommandCenter) &
+                               (cols.alliance == features.PlayerRelative.SELF) & (cols.build_progress >= 100))
+        saturation = self.load(cols, rows) / ideal
+        distance = np.linalg.norm(xy[rows] - xy[scv], axis=1)
+
+        candidates = np.ones(len(rows), dtype=bool)
+        if len(bases):
+            to_base = np.linalg.norm(xy[rows][:, None, :] - xy[bases][None, :, :], axis=2)
+            base_of = np.where(to_base.min(axis=1) <= BASE_RANGE, np.argmin(to_base, axis=1), -1)
+            own_base = np.argmin(np.linalg.norm(xy[bases] - xy[scv], axis=1))
+            candidates = base_of >= 0
+            mine = base_of == own_base
+            if (mine & (saturation < 1)).any() or not (candidates & (saturation < 1)).any():
+                candidates &= mine
+            if not candidates.any():
+                candidates[:] = True
+        best = np.flatnonzero(candidates)[np.lexsort((distance[candidates], saturation[candidates]))[0]]
+        self.assigned[scv_tag] = int(cols.tags[rows[best]])
+        return [int(xy[rows[best], 0]), int(xy[rows[best], 1])]
@@ -0,0 +1,859 @@
+"""
+headless stand-in environment for the pysc2 minigames
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+A small, seeded, deterministic simulator that emits pysc2-shaped TimeSteps
+for the five minigames, so the agents in final_agent_lzh.py can be run,
+benchmarked and regression-tested without the StarCraft II binary.
+
+The rules are deliberately simplified (no collision, square footprints,
+one weapon per unit), but keep the parts the agents rely on:
+selection, available_actions, supply, build/train times, harvesting
+with one worker per mineral patch at a time, combat and rewards.
+
+Usage:
+    env = MiniGameEnv("BuildMarines", seed=0)
+    pysc2.env.run_loop.run_loop([final_agent_lzh.BuildMarines()], env, max_episodes=1)
+"""
+
+import collections
+import time
+
+import numpy as np
+from pysc2.env import environment
+from pysc2.lib import actions
+from pysc2.lib import features
+from pysc2.lib import named_array
+from pysc2.lib import units
+
+FUNCTIONS = actions.FUNCTIONS
+
+GAME_LOOPS_PER_SECOND = 22.4
+TICK_LOOPS = 4 # simulation resolution in game loops, agent steps are split into ticks of at most this length
+
+MINERAL_SHARD = 1680 # not in pysc2.lib.units
+
+# alliance / owner
+SELF = features.PlayerRelative.SELF
+ENEMY = features.PlayerRelative.ENEMY
+NEUTRAL = features.PlayerRelative.NEUTRAL
+_OWNER = {SELF: 1, ENEMY: 2, NEUTRAL: 16}
+
+# unit stats, distances are in screen pixels and times in game seconds
+UnitStats = collections.namedtuple("UnitStats", [
+    "radius", "health", "armor", "speed", "damage", "cooldown", "range", "food", "minerals", "build_time"])
+
+UNIT_STATS = {
+    units.Terran.SCV:           UnitStats(1, 45, 0, 13.8, 5, 1.07, 0.5, 1, 50, 12),
+    units.Terran.Marine:        UnitStats(1, 45, 0, 11.0, 6, 0.61, 17.5, 1, 50, 18),
+    units.Terran.CommandCenter: UnitStats(9, 1500, 1, 0, 0, 0, 0, 0, 400, 71),
+    units.Terran.SupplyDepot:   UnitStats(4, 400, 1, 0, 0, 0, 0, 0, 100, 21),
+    units.Terran.Barracks:      UnitStats(6, 1000, 1, 0, 0, 0, 0, 0, 150, 46),
+    units.Terran.Refinery:      UnitStats(5, 500, 1, 0, 0, 0, 0, 0, 75, 21),
+    units.Zerg.Roach:           UnitStats(2, 145, 1, 11.0, 16, 1.43, 14.0, 0, 0, 0),
+    units.Zerg.Zergling:        UnitStats(1, 35, 0, 14.5, 5, 0.50, 1.0, 0, 0, 0),
+    units.Zerg.Baneling:        UnitStats(1, 30, 0, 11.5, 35, 0, 1.0, 0, 0, 0),
+    units.Neutral.MineralField: UnitStats(3, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+    units.Neutral.VespeneGeyser: UnitStats(5, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+    MINERAL_SHARD:              UnitStats(1, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+}
+
+BUILDINGS = (units.Terran.CommandCenter, units.Terran.SupplyDepot, units.Terran.Barracks, units.Terran.Refinery)
+RESOURCES = (units.Neutral.MineralField, units.Neutral.VespeneGeyser, MINERAL_SHARD)
+FOOD_CAP = {units.Terran.CommandCenter: 15, units.Terran.SupplyDepot: 8}
+
+MINERALS_PER_TRIP = 5
+GAS_PER_TRIP = 4
+MINING_TIME = 2.8
+GAS_MINING_TIME = 2.0
+BOUNCE_RANGE = 8.0 # a worker finding its mineral field taken moves on to a free one this close
+SIGHT = 35.0 # enemies start attacking once an own unit gets this close
+BANELING_SPLASH = 7.7
+MAX_QUEUE = 5
+
+BUILD_FUNCTIONS = {
+    FUNCTIONS.Build_CommandCenter_screen.id: units.Terran.CommandCenter,
+    FUNCTIONS.Build_SupplyDepot_screen.id: units.Terran.SupplyDepot,
+    FUNCTIONS.Build_Barracks_screen.id: units.Terran.Barracks,
+    FUNCTIONS.Build_Refinery_screen.id: units.Terran.Refinery,
+}
+TRAIN_FUNCTIONS = {
+    FUNCTIONS.Train_SCV_quick.id: (units.Terran.CommandCenter, units.Terran.SCV),
+    FUNCTIONS.Train_Marine_quick.id: (units.Terran.Barracks, units.Terran.Marine),
+}
+
+# map name -> game length in seconds
+MAPS = collections.OrderedDict([
+    ("CollectMineralShards", 120),
+    ("CollectMineralsAndGas", 300),
+    ("DefeatRoaches", 120),
+    ("DefeatZerglingsAndBanelings", 120),
+    ("BuildMarines", 900),
+])
+
+
+class _Unit:
+    __slots__ = ("tag", "unit_type", "alliance", "x", "y", "radius", "health", "stats", "orders",
+                 "is_selected", "build_progress", "contents", "carry", "phase", "timer", "cooldown",
+                 "aggro", "resource", "builder", "miner")
+
+    def __init__(self, tag, unit_type, alliance, x, y, build_progress=100):
+        stats = UNIT_STATS[unit_type]
+        self.tag = tag
+        self.unit_type = unit_type
+        self.alliance = alliance
+        self.x = float(x)
+        self.y = float(y)
+        self.radius = stats.radius
+        self.health = float(stats.health)
+        self.stats = stats
+        self.orders = []
+        self.is_selected = False
+        self.build_progress = float(build_progress)
+        self.contents = 0 # minerals / vespene left in a resource
+        self.carry = 0 # minerals / gas carried by a worker
+        self.phase = None # harvest phase of a worker: to_resource, mining, to_base
+        self.timer = 0. # mining time of a worker, training time of a building
+        self.cooldown = 0.
+        self.aggro = False
+        self.resource = None # tag of the resource a worker harvests
+        self.builder = None # tag of the scv constructing a building
+        self.miner = None # tag of the scv mining a resource
+
+    @property
+    def complete(self):
+        return self.build_progress >= 100
+
+
+class MiniGameEnv:
+    """
+    stand-in for pysc2.env.sc2_env.SC2Env on the five minigames,
+    single agent, feature layers + feature_units interface
+    """
+
+    def __init__(self, map_name, seed=None, step_mul=8, screen_size=84, game_steps_per_episode=None,
+                 unit_count=None, step_latency=0.):
+        """
+        :param unit_count: if given, pad the map with extra units up to this many at reset,
+                           used to benchmark agents at larger scales
+        :param step_latency: seconds every step sleeps, like the round trip to a StarCraft II process,
+                             used to measure drivers that overlap the steps of many envs
+        """
+        if map_name not in MAPS:
+            raise ValueError("Unknown minigame: %s" % map_name)
+        self.map_name = map_name
+        self.step_mul = step_mul
+        self.screen_size = screen_size
+        self.game_steps_per_episode = game_steps_per_episode or int(MAPS[map_name] * GAME_LOOPS_PER_SECOND)
+        self.unit_count = unit_count
+        self.step_latency = step_latency
+        self._rng = np.random.RandomState(seed)
+        self._handlers = {
+            FUNCTIONS.no_op.id: lambda args: None,
+            FUNCTIONS.select_point.id: self._select_point,
+            FUNCTIONS.select_rect.id: self._select_rect,
+            FUNCTIONS.select_control_group.id: self._select_control_group,
+            FUNCTIONS.select_idle_worker.id: self._select_idle_worker,
+            FUNCTIONS.select_army.id: self._select_army,
+            FUNCTIONS.Move_screen.id: lambda args: self._command(args, ("move",)),
+            FUNCTIONS.Attack_screen.id: lambda args: self._command(args, ("attack",)),
+            FUNCTIONS.Harvest_Gather_screen.id: self._harvest_gather,
+            FUNCTIONS.Harvest_Return_quick.id: self._harvest_return,
+            FUNCTIONS.Stop_quick.id: self._stop,
+            FUNCTIONS.HoldPosition_quick.id: self._stop,
+        }
+        for func_id in BUILD_FUNCTIONS:
+            self._handlers[func_id] = lambda args, func_id=func_id: self._build(args, BUILD_FUNCTIONS[func_id])
+        for func_id in TRAIN_FUNCTIONS:
+            self._handlers[func_id] = lambda args, func_id=func_id: self._train(*TRAIN_FUNCTIONS[func_id])
+
+    # ---- pysc2 environment interface ----
+
+    def observation_spec(self):
+        n = self.screen_size
+        return ({
+            "feature_screen": (len(features.SCREEN_FEATURES), n, n),
+            "feature_units": (0, len(features.FeatureUnit)),
+            "player": (len(features.Player),),
+            "available_actions": (0,),
+            "single_select": (0, 7),
+            "multi_select": (0, 7),
+            "control_groups": (10, 2),
+            "game_loop": (1,),
+            "score_cumulative": (13,),
+        },)
+
+    def action_spec(self):
+        sizes = {"screen": (self.screen_size, self.screen_size), "screen2": (self.screen_size, self.screen_size),
+                 "minimap": (64, 64)}
+        types = actions.Arguments(*[
+            actions.ArgumentType.spec(t.id, t.name, sizes.get(t.name, t.sizes))
+            for t in actions.TYPES])
+        functions = actions.Functions([
+            actions.Function.spec(f.id, f.name, tuple(types[t.id] for t in f.args))
+            for f in actions.FUNCTIONS])
+        return (actions.ValidActions(types, functions),)
+
+    def seed(self, seed):
+        """
+        restart the random state, the next reset plays the same episode as a new env with this seed
+        """
+        self._rng = np.random.RandomState(seed)
+
+    def reset(self):
+        self._units = []
+        self._by_tag = {}
+        self._next_tag = 1
+        self._minerals = 50
+        self._vespene = 0
+        self._game_loop = 0
+        self._score = 0
+        self._reward = 0
+        self._control_groups = [[] for _ in range(10)]
+        self._screen = None
+        self._padding = set() # tags of the units added by _pad_units
+        getattr(self, "_setup_" + self.map_name)()
+        if self.unit_count:
+            self._pad_units(self.unit_count)
+        return (self._timestep(environment.StepType.FIRST),)
+
+    def step(self, actions):
+        if self.step_latency:
+            time.sleep(self.step_latency)
+        self._reward = 0
+        self._apply(actions[0])
+        loops = self.step_mul
+        while loops > 0:
+            dt_loops = min(loops, TICK_LOOPS)
+            self._tick(dt_loops / GAME_LOOPS_PER_SECOND)
+            self._game_loop += dt_loops
+            loops -= dt_loops
+            if self._episode_over():
+                break
+        self._score += self._reward
+        if self._episode_over():
+            return (self._timestep(environment.StepType.LAST),)
+        return (self._timestep(environment.StepType.MID),)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *argv):
+        self.close()
+
+    # ---- map setup ----
+
+    def _setup_CollectMineralShards(self):
+        for x, y in [[20, 38], [20, 46]]:
+            self._add(units.Terran.Marine, SELF, x, y)
+        self._spawn_shards()
+
+    def _setup_CollectMineralsAndGas(self):
+        self._setup_base()
+        for x, y in [[14, 8], [14, 62]]:
+            self._add(units.Neutral.VespeneGeyser, NEUTRAL, x, y).contents = 2250
+
+    def _setup_BuildMarines(self):
+        self._setup_base()
+
+    def _setup_base(self):
+        self._add(units.Terran.CommandCenter, SELF, 33, 33)
+        for y in range(18, 52, 5):
+            self._add(units.Neutral.MineralField, NEUTRAL, 8 + (y // 5) % 2 * 2, y).contents = 1800
+        for i in range(12):
+            self._add(units.Terran.SCV, SELF, 20 + i % 3 * 2, 24 + i // 3 * 3)
+
+    def _setup_DefeatRoaches(self):
+        self._spawn_marines(9)
+        self._spawn_wave([units.Zerg.Roach] * 4)
+
+    def _setup_DefeatZerglingsAndBanelings(self):
+        self._spawn_marines(9)
+        self._spawn_wave([units.Zerg.Zergling] * 6 + [units.Zerg.Baneling] * 4)
+
+    def _pad_units(self, unit_count):
+        # own padding units don't use food, so the supply of the map stays as without padding
+        padding = {
+            "CollectMineralShards": [(MINERAL_SHARD, NEUTRAL)],
+            "CollectMineralsAndGas": [(units.Terran.SCV, SELF)],
+            "BuildMarines": [(units.Terran.Marine, SELF)],
+            "DefeatRoaches": [(units.Terran.Marine, SELF), (units.Zerg.Roach, ENEMY)],
+            "DefeatZerglingsAndBanelings": [(units.Terran.Marine, SELF), (units.Zerg.Zergling, ENEMY)],
+        }[self.map_name]
+        for i in range(unit_count - len(self._units)):
+            unit_type, alliance = padding[i % len(padding)]
+            x = self._rng.randint(4, self.screen_size // 2) + (self.screen_size // 2 - 4 if alliance == ENEMY else 0)
+            self._padding.add(self._add(unit_type, alliance, x, self._rng.randint(4, self.screen_size - 4)).tag)
+
+    def _spawn_shards(self):
+        for x, y in self._rng.randint(4, self.screen_size - 4, size=(20, 2)):
+            self._add(MINERAL_SHARD, NEUTRAL, x, y)
+
+    def _spawn_marines(self, cnt):
+        for i in range(cnt):
+            self._add(units.Terran.Marine, SELF, 15 + i % 2 * 3, 22 + 40. * i / max(cnt - 1, 1))
+
+    def _spawn_wave(self, unit_types):
+        for i, unit_type in enumerate(unit_types):
+            self._add(unit_type, ENEMY, 66 + i % 2 * 4, 24 + 36. * i / max(len(unit_types) - 1, 1))
+
+    def _add(self, unit_type, alliance, x, y, build_progress=100):
+        unit = _Unit(self._next_tag, unit_type, alliance, x, y, build_progress)
+        self._next_tag += 1
+        self._units.append(unit)
+        self._by_tag[unit.tag] = unit
+        if unit_type in BUILDINGS or unit_type in RESOURCES:
+            self._screen = None
+        return unit
+
+    # ---- actions ----
+
+    def _apply(self, action):
+        func_id = int(action.function)
+        if func_id not in self._available:
+            raise ValueError("Function %s/%s is currently not available" % (func_id, FUNCTIONS[func_id].name))
+        handler = self._handlers.get(func_id)
+        if handler:
+            handler(action.arguments)
+
+    def _selected(self):
+        return [u for u in self._units if u.is_selected]
+
+    def _set_selection(self, selected, add=False):
+        if not add:
+            for u in self._units:
+                u.is_selected = False
+        for u in selected:
+            u.is_selected = True
+
+    def _unit_at(self, x, y):
+        best, best_d = None, None
+        for u in self._units:
+            if abs(u.x - x) <= u.radius + 0.5 and abs(u.y - y) <= u.radius + 0.5:
+                d = (u.x - x) ** 2 + (u.y - y) ** 2 - (u.alliance == SELF)
+                if best is None or d < best_d:
+                    best, best_d = u, d
+        return best
+
+    def _select_point(self, args):
+        act = int(args[0][0])
+        unit = self._unit_at(*args[1])
+        if unit is None:
+            if act == actions.SelectPointAct.select:
+                self._set_selection([])
+            return
+        if act == actions.SelectPointAct.select:
+            self._set_selection([unit])
+        elif act == actions.SelectPointAct.toggle:
+            unit.is_selected = not unit.is_selected
+        else:
+            same_type = [u for u in self._units if u.unit_type == unit.unit_type and u.alliance == unit.alliance]
+            self._set_selection(same_type, add=act == actions.SelectPointAct.add_all_type)
+
+    def _select_rect(self, args):
+        (x0, y0), (x1, y1) = args[1], args[2]
+        x0, x1 = sorted([x0, x1])
+        y0, y1 = sorted([y0, y1])
+        inside = [u for u in self._units if u.alliance == SELF and x0 <= u.x <= x1 and y0 <= u.y <= y1]
+        movable = [u for u in inside if u.unit_type not in BUILDINGS]
+        self._set_selection(movable or inside, add=int(args[0][0]) == actions.SelectAdd.add)
+
+    def _select_control_group(self, args):
+        act, group = int(args[0][0]), int(args[1][0])
+        if act == actions.ControlGroupAct.recall:
+            self._set_selection([self._by_tag[tag] for tag in self._control_groups[group]])
+            return
+        if act in (actions.ControlGroupAct.set_and_steal, actions.ControlGroupAct.append_and_steal):
+            selected_tags = set(u.tag for u in self._selected())
+            for tags in self._control_groups:
+                tags[:] = [tag for tag in tags if tag not in selected_tags]
+        if act in (actions.ControlGroupAct.set, actions.ControlGroupAct.set_and_steal):
+            self._control_groups[group] = []
+        for u in self._selected():
+            if u.alliance == SELF and u.tag not in self._control_groups[group]:
+                self._control_groups[group].append(u.tag)
+
+    def _select_idle_worker(self, args):
+        act = int(args[0][0])
+        idle = [u for u in self._units if u.unit_type == units.Terran.SCV and not u.orders]
+        if act in (actions.SelectWorker.select, actions.SelectWorker.add):
+            idle = idle[:1]
+        self._set_selection(idle, add=act in (actions.SelectWorker.add, actions.SelectWorker.add_all))
+
+    def _select_army(self, args):
+        army = [u for u in self._units if u.alliance == SELF and u.unit_type == units.Terran.Marine]
+        self._set_selection(army, add=int(args[0][0]) == actions.SelectAdd.add)
+
+    def _movers(self):
+        return [u for u in self._selected() if u.alliance == SELF and u.stats.speed > 0]
+
+    def _order(self, unit, order, queued):
+        if not queued:
+            unit.orders = []
+            if order[0] != "harvest":
+                unit.phase = None
+        unit.orders.append(order)
+
+    def _command(self, args, order):
+        queued = int(args[0][0]) == actions.Queued.queued
+        x, y = args[1]
+        target = None
+        if order[0] == "attack":
+            unit = self._unit_at(x, y)
+            if unit is not None and unit.alliance == ENEMY:
+                target = unit.tag
+        for u in self._movers():
+            self._order(u, order + (float(x), float(y), target), queued)
+
+    def _stop(self, args):
+        for u in self._movers():
+            u.orders = []
+            u.phase = None
+
+    def _harvest_gather(self, args):
+        queued = int(args[0][0]) == actions.Queued.queued
+        resource = self._unit_at(*args[1])
+        if resource is None or not self._harvestable(resource):
+            return
+        for u in self._selected():
+            if u.unit_type == units.Terran.SCV:
+                if not queued:
+                    u.phase = None
+                self._order(u, ("harvest", resource.tag), queued)
+
+    def _harvest_return(self, args):
+        queued = int(args[0][0]) == actions.Queued.queued
+        for u in self._selected():
+            if u.unit_type == units.Terran.SCV and u.carry:
+                resource = u.resource if u.resource in self._by_tag else None
+                self._order(u, ("harvest", resource), queued)
+                if not queued:
+                    u.phase = "to_base"
+
+    def _harvestable(self, unit):
+        if unit.unit_type == units.Neutral.MineralField:
+            return True
+        return unit.unit_type == units.Terran.Refinery and unit.alliance == SELF and unit.complete
+
+    def _placement_ok(self, unit_type, x, y, ignore=None):
+        r = UNIT_STATS[unit_type].radius
+        if x - r < 0 or y - r < 0 or x + r > self.screen_size or y + r > self.screen_size:
+            return False
+        for u in self._units:
+            if u is ignore or (u.unit_type not in BUILDINGS and u.unit_type not in RESOURCES) or u.unit_type == MINERAL_SHARD:
+                continue
+            if abs(u.x - x) < u.radius + r and abs(u.y - y) < u.radius + r:
+                return False
+        return True
+
+    def _build(self, args, unit_type):
+        queued = int(args[0][0]) == actions.Queued.queued
+        x, y = float(args[1][0]), float(args[1][1])
+        scvs = [u for u in self._selected() if u.unit_type == units.Terran.SCV]
+        if not scvs:
+            return
+        if unit_type == units.Terran.Refinery:
+            geyser = self._unit_at(x, y)
+            if geyser is None or geyser.unit_type != units.Neutral.VespeneGeyser:
+                return
+            x, y = geyser.x, geyser.y
+        elif not self._placement_ok(unit_type, x, y):
+            return
+        self._order(scvs[0], ("build", unit_type, x, y), queued)
+
+    def _train(self, building_type, unit_type):
+        stats = UNIT_STATS[unit_type]
+        buildings = [u for u in self._selected()
+                     if u.unit_type == building_type and u.complete and len(u.orders) < MAX_QUEUE]
+        if not buildings:
+            return
+        if self._food_cap() - self._food_used() < stats.food:
+            return
+        building = min(buildings, key=lambda u: len(u.orders))
+        self._minerals -= stats.minerals
+        building.orders.append(("train", unit_type))
+
+    # ---- simulation ----
+
+    def _tick(self, dt):
+        # unit groups looked up by many units in a tick
+        self._enemies = [u for u in self._units if u.alliance == ENEMY]
+        self._own_ground = [u for u in self._units if u.alliance == SELF and u.unit_type not in BUILDINGS]
+        self._fields = [u for u in self._units if u.unit_type == units.Neutral.MineralField]
+        self._bases = [u for u in self._units if u.unit_type == units.Terran.CommandCenter and u.complete]
+        for u in list(self._units):
+            if u.health <= 0 and u.unit_type not in RESOURCES:
+                continue
+            if u.cooldown > 0:
+                u.cooldown -= dt
+            if u.unit_type in BUILDINGS:
+                self._tick_building(u, dt)
+            elif u.alliance == ENEMY:
+                self._tick_enemy(u, dt)
+            elif u.alliance == SELF:
+                self._tick_own(u, dt)
+        self._remove_dead()
+
+        if self.map_name == "CollectMineralShards":
+            self._collect_shards()
+        elif self.map_name in ("DefeatRoaches", "DefeatZerglingsAndBanelings"):
+            if not any(u.alliance == ENEMY for u in self._units) and any(u.alliance == SELF for u in self._units):
+                if self.map_name == "DefeatRoaches":
+                    self._spawn_marines(5)
+                    self._spawn_wave([units.Zerg.Roach] * 4)
+                else:
+                    self._spawn_marines(4)
+                    self._spawn_wave([units.Zerg.Zergling] * 6 + [units.Zerg.Baneling] * 4)
+
+    def _remove_dead(self):
+        alive = []
+        for u in self._units:
+            if u.unit_type == units.Neutral.MineralField:
+                dead = u.contents <= 0
+            else:
+                dead = u.health <= 0 and u.unit_type not in RESOURCES
+            if dead:
+                del self._by_tag[u.tag]
+                if u.unit_type in BUILDINGS or u.unit_type in RESOURCES:
+                    self._screen = None
+                if u.alliance == SELF and self.map_name in ("DefeatRoaches", "DefeatZerglingsAndBanelings"):
+                    self._reward -= 1
+            else:
+                alive.append(u)
+        self._units = alive
+        for tags in self._control_groups:
+            tags[:] = [tag for tag in tags if tag in self._by_tag]
+
+    def _collect_shards(self):
+        marines = [u for u in self._units if u.unit_type == units.Terran.Marine]
+        shards = [u for u in self._units if u.unit_type == MINERAL_SHARD]
+        for shard in shards:
+            for m in marines:
+                if (m.x - shard.x) ** 2 + (m.y - shard.y) ** 2 <= (m.radius + shard.radius) ** 2:
+                    self._units.remove(shard)
+                    del self._by_tag[shard.tag]
+                    self._reward += 1
+                    break
+        if len(shards) and not any(u.unit_type == MINERAL_SHARD for u in self._units):
+            self._spawn_shards()
+
+    def _move_towards(self, u, x, y, dt, stop_at=0.):
+        dx, dy = x - u.x, y - u.y
+        dist = (dx * dx + dy * dy) ** 0.5
+        step = u.stats.speed * dt
+        if dist - stop_at <= step:
+            if dist > stop_at:
+                u.x += dx / dist * (dist - stop_at)
+                u.y += dy / dist * (dist - stop_at)
+            return True
+        u.x = min(max(0., u.x + dx / dist * step), self.screen_size - 1.)
+        u.y = min(max(0., u.y + dy / dist * step), self.screen_size - 1.)
+        return False
+
+    @staticmethod
+    def _gap(a, b):
+        return ((a.x - b.x) ** 2 + (a.y - b.y) ** 2) ** 0.5 - a.radius - b.radius
+
+    def _nearest(self, u, candidates):
+        best, best_d = None, None
+        for c in candidates:
+            d = (c.x - u.x) ** 2 + (c.y - u.y) ** 2
+            if best is None or d < best_d:
+                best, best_d = c, d
+        return best
+
+    def _attack(self, u, target, dt):
+        """
+        attack target if in range, else chase it
+        """
+        if self._gap(u, target) > u.stats.range + 1e-6:
+            self._move_towards(u, target.x, target.y, dt, stop_at=u.stats.range + u.radius + target.radius)
+            return
+        if u.unit_type == units.Zerg.Baneling:
+            for v in self._own_ground:
+                if v.health > 0 and (v.x - u.x) ** 2 + (v.y - u.y) ** 2 <= BANELING_SPLASH ** 2:
+                    v.health -= u.stats.damage - v.stats.armor
+            u.health = 0
+            return
+        if u.cooldown <= 0:
+            u.cooldown = u.stats.cooldown
+            was_alive = target.health > 0
+            target.health -= max(u.stats.damage - target.stats.armor, 0.5)
+            target.aggro = True
+            if was_alive and target.health <= 0 and target.alliance == ENEMY:
+                self._reward += 10 if target.unit_type == units.Zerg.Roach else 5
+
+    def _enemies_in_range(self, u):
+        return [v for v in self._enemies if v.health > 0 and self._gap(u, v) <= u.stats.range]
+
+    def _tick_enemy(self, u, dt):
+        own = [v for v in self._own_ground if v.health > 0]
+        if not own:
+            return
+        target = self._nearest(u, own)
+        if not u.aggro and self._gap(u, target) > SIGHT:
+            return
+        u.aggro = True
+        self._attack(u, target, dt)
+
+    def _tick_own(self, u, dt):
+        if u.unit_type == units.Terran.SCV and u.orders and u.orders[0][0] in ("harvest", "build"):
+            if u.orders[0][0] == "harvest":
+                self._tick_harvest(u, dt)
+            else:
+                self._tick_build(u, dt)
+            return
+        if not u.orders:
+            if self._enemies and u.stats.damage and u.unit_type != units.Terran.SCV:
+                in_range = self._enemies_in_range(u)
+                if in_range:
+                    self._attack(u, self._nearest(u, in_range), dt)
+            return
+        order = u.orders[0]
+        if order[0] == "attack":
+            target = self._by_tag.get(order[3])
+            if target is None or target.health <= 0:
+                in_range = self._enemies_in_range(u)
+                target = self._nearest(u, in_range) if in_range else None
+            if target is not None:
+                self._attack(u, target, dt)
+                return
+        if self._move_towards(u, order[1], order[2], dt):
+            u.orders.pop(0)
+
+    def _tick_harvest(self, u, dt):
+        resource = self._by_tag.get(u.orders[0][1])
+        if resource is None and u.phase != "to_base":
+            # resource is gone, fall back to the nearest mineral field
+            fields = [v for v in self._fields if v.contents > 0]
+            if not fields:
+                u.orders.pop(0)
+                u.phase = None
+                return
+            resource = self._nearest(u, fields)
+            u.orders[0] = ("harvest", resource.tag)
+        if resource is not None:
+            u.resource = resource.tag
+        if u.phase is None:
+            u.phase = "to_base" if u.carry else "to_resource"
+        if u.phase == "to_resource":
+            if self._move_towards(u, resource.x, resource.y, dt, stop_at=resource.radius + u.radius):
+                if not self._resource_free(resource):
+                    # only one worker mines a resource at a time,
+                    # like in the game a worker bounces to a free mineral field nearby, else waits
+                    if resource.unit_type != units.Neutral.MineralField:
+                        return
+                    free = [v for v in self._fields if v.contents > 0 and
+                            self._resource_free(v) and self._gap(u, v) <= BOUNCE_RANGE]
+                    if not free:
+                        return
+                    resource = self._nearest(u, free)
+                    u.orders[0] = ("harvest", resource.tag)
+                    u.resource = resource.tag
+                    return
+                resource.miner = u.tag
+                u.phase = "mining"
+                u.timer = MINING_TIME if resource.unit_type == units.Neutral.MineralField else GAS_MINING_TIME
+        elif u.phase == "mining":
+            u.timer -= dt
+            if u.timer <= 0:
+                resource.miner = None
+                if resource.unit_type == units.Neutral.MineralField:
+                    u.carry = min(MINERALS_PER_TRIP, resource.contents)
+                    resource.contents -= u.carry
+                else:
+                    u.carry = GAS_PER_TRIP
+                u.phase = "to_base"
+        elif u.phase == "to_base":
+            if not self._bases:
+                return
+            base = self._nearest(u, self._bases)
+            if self._move_towards(u, base.x, base.y, dt, stop_at=base.radius + u.radius):
+                resource = self._by_tag.get(u.resource)
+                if resource is not None and resource.unit_type == units.Terran.Refinery:
+                    self._vespene += u.carry
+                else:
+                    self._minerals += u.carry
+                if self.map_name == "CollectMineralsAndGas":
+                    self._reward += u.carry
+                u.carry = 0
+                if resource is None:
+                    u.orders.pop(0)
+                    u.phase = None
+                else:
+                    u.phase = "to_resource"
+
+    def _resource_free(self, resource):
+        miner = self._by_tag.get(resource.miner)
+        return miner is None or miner.phase != "mining" or miner.resource != resource.tag
+
+    def _tick_build(self, u, dt):
+        _, unit_type, x, y = u.orders[0]
+        if not self._move_towards(u, x, y, dt, stop_at=UNIT_STATS[unit_type].radius + u.radius):
+            return
+        building = next((v for v in self._units if v.builder == u.tag and v.unit_type == unit_type), None)
+        if building is None:
+            if unit_type == units.Terran.Refinery:
+                geyser = next((v for v in self._units if v.unit_type == units.Neutral.VespeneGeyser and
+                               v.x == x and v.y == y), None)
+                ok = geyser is not None and not any(v.unit_type == units.Terran.Refinery and v.x == x and v.y == y
+                                                    for v in self._units)
+            else:
+                ok = self._placement_ok(unit_type, x, y)
+            if not ok or self._minerals < UNIT_STATS[unit_type].minerals:
+                # spot got blocked or minerals spent on the way, give up
+                u.orders.pop(0)
+                return
+            self._minerals -= UNIT_STATS[unit_type].minerals
+            building = self._add(unit_type, SELF, x, y, build_progress=0)
+            building.builder = u.tag
+            building.health = 1.
+        building.build_progress += 100. * dt / building.stats.build_time
+        building.health = min(building.stats.health, building.health + building.stats.health * dt / building.stats.build_time)
+        if building.complete:
+            building.build_progress = 100.
+            building.builder = None
+            u.orders.pop(0)
+
+    def _tick_building(self, u, dt):
+        if not u.complete or not u.orders:
+            return
+        unit_type = u.orders[0][1]
+        u.timer += dt
+        if u.timer >= UNIT_STATS[unit_type].build_time:
+            u.timer = 0.
+            u.orders.pop(0)
+            self._add(unit_type, SELF, min(u.x + u.radius + 1, self.screen_size - 1), min(u.y + u.radius, self.screen_size - 1))
+            if self.map_name == "BuildMarines" and unit_type == units.Terran.Marine:
+                self._reward += 1
+
+    def _episode_over(self):
+        if self._game_loop >= self.game_steps_per_episode:
+            return True
+        if self.map_name in ("DefeatRoaches", "DefeatZerglingsAndBanelings"):
+            return not any(u.alliance == SELF for u in self._units)
+        return False
+
+    # ---- observation ----
+
+    def _food_cap(self):
+        return min(200, sum(FOOD_CAP.get(u.unit_type, 0) for u in self._units if u.alliance == SELF and u.complete))
+
+    def _food_used(self):
+        used = 0
+        for u in self._units:
+            if u.alliance != SELF or u.tag in self._padding:
+                continue
+            used += u.stats.food
+            for order in u.orders:
+                if order[0] == "train":
+                    used += UNIT_STATS[order[1]].food
+        return used
+
+    def _available_actions(self):
+        available = [FUNCTIONS.no_op.id, FUNCTIONS.select_point.id, FUNCTIONS.select_rect.id,
+                     FUNCTIONS.select_control_group.id]
+        if any(u.unit_type == units.Terran.Marine for u in self._units):
+            available.append(FUNCTIONS.select_army.id)
+        if any(u.unit_type == units.Terran.SCV and not u.orders for u in self._units):
+            available.append(FUNCTIONS.select_idle_worker.id)
+        selected = [u for u in self._selected() if u.alliance == SELF]
+        types = set(u.unit_type for u in selected if u.complete)
+        if any(u.stats.speed > 0 for u in selected):
+            available += [FUNCTIONS.Move_screen.id, FUNCTIONS.Attack_screen.id,
+                          FUNCTIONS.Stop_quick.id, FUNCTIONS.HoldPosition_quick.id]
+        if units.Terran.SCV in types:
+            available.append(FUNCTIONS.Harvest_Gather_screen.id)
+            if any(u.carry for u in selected):
+                available.append(FUNCTIONS.Harvest_Return_quick.id)
+            has_depot = any(u.unit_type == units.Terran.SupplyDepot and u.complete for u in self._units)
+            for func_id, unit_type in BUILD_FUNCTIONS.items():
+                if unit_type == units.Terran.Barracks and not has_depot:
+                    continue
+                if self._minerals >= UNIT_STATS[unit_type].minerals:
+                    available.append(func_id)
+        for func_id, (building_type, unit_type) in TRAIN_FUNCTIONS.items():
+            if building_type in types and self._minerals >= UNIT_STATS[unit_type].minerals:
+                available.append(func_id)
+        return np.array(available, dtype=np.int32)
+
+    def _feature_screen(self):
+        # static layers only change when buildings or resources change
+        if self._screen is None:
+            n = self.screen_size
+            screen = np.zeros((len(features.SCREEN_FEATURES), n, n), dtype=np.int32)
+            screen[features.SCREEN_FEATURES.visibility_map.index] = 2
+            screen[features.SCREEN_FEATURES.pathable.index] = 1
+            screen[features.SCREEN_FEATURES.buildable.index] = 1
+            for u in self._units:
+                if u.unit_type in BUILDINGS or u.unit_type in RESOURCES and u.unit_type != MINERAL_SHARD:
+                    x0, y0 = max(0, int(u.x - u.radius)), max(0, int(u.y - u.radius))
+                    x1, y1 = int(u.x + u.radius), int(u.y + u.radius)
+                    screen[features.SCREEN_FEATURES.pathable.index, y0:y1, x0:x1] = 0
+                    screen[features.SCREEN_FEATURES.buildable.index, y0:y1, x0:x1] = 0
+            self._screen = named_array.NamedNumpyArray(screen, [features.ScreenFeatures, None, None])
+        return self._screen
+
+    def _feature_units(self):
+        FU = features.FeatureUnit
+        cols = [FU.unit_type, FU.alliance, FU.health, FU.health_ratio, FU.build_progress, FU.owner, FU.x, FU.y,
+                FU.radius, FU.is_selected, FU.mineral_contents, FU.vespene_contents, FU.order_length, FU.tag,
+                FU.display_type, FU.is_on_screen, FU.order_id_0, FU.assigned_harvesters, FU.ideal_harvesters]
+        harvesters = collections.Counter(
+            u.resource for u in self._units if u.unit_type == units.Terran.SCV and u.orders and u.orders[0][0] == "harvest")
+        rows = []
+        for u in self._units:
+            is_mineral = u.unit_type == units.Neutral.MineralField
+            rows.append((
+                u.unit_type, u.alliance, max(int(u.health), 0),
+                int(255 * max(u.health, 0) / u.stats.health) if u.stats.health else 0,
+                int(u.build_progress), _OWNER[u.alliance], int(u.x), int(u.y), u.radius, int(u.is_selected),
+                u.contents if is_mineral else 0,
+                u.contents if u.unit_type == units.Neutral.VespeneGeyser else 0,
+                len(u.orders), u.tag, 1, 1, 0,
+                harvesters.get(u.tag, 0),
+                2 if is_mineral else 3 if u.unit_type == units.Terran.Refinery else 0,
+            ))
+        feature_units = np.zeros((len(rows), len(FU)), dtype=np.int64)
+        if rows:
+            feature_units[:, cols] = np.array(rows, dtype=np.int64)
+        return named_array.NamedNumpyArray(feature_units, [None, FU])
+
+    def _select_array(self, selected):
+        return np.array([[u.unit_type, u.alliance, max(int(u.health), 0), 0, 0, 0, int(u.build_progress)]
+                         for u in selected], dtype=np.int32).reshape(-1, 7)
+
+    def _timestep(self, step_type):
+        selected = self._selected()
+        food_used = self._food_used()
+        self._available = self._available_actions()
+        scvs = [u for u in self._units if u.unit_type == units.Terran.SCV]
+        army = [u for u in self._units if u.alliance == SELF and u.unit_type == units.Terran.Marine]
+        player = np.array([1, self._minerals, self._vespene, food_used, self._food_cap(), len(army), len(scvs),
+                           sum(1 for u in scvs if not u.orders), len(army), 0, 0], dtype=np.int32)
+        control_groups = np.zeros((10, 2), dtype=np.int32)
+        for i, tags in enumerate(self._control_groups):
+            if tags:
+                control_groups[i] = [self._by_tag[tags[0]].unit_type, len(tags)]
+        score = np.zeros(13, dtype=np.int32)
+        score[0] = self._score
+        observation = named_array.NamedDict(
+            feature_screen=self._feature_screen(),
+            feature_units=self._feature_units(),
+            player=named_array.NamedNumpyArray(player, [features.Player]),
+            available_actions=self._available,
+            single_select=self._select_array(selected if len(selected) == 1 else []),
+            multi_select=self._select_array(selected if len(selected) > 1 else []),
+            control_groups=control_groups,
+            game_loop=np.array([self._game_loop], dtype=np.int32),
+            score_cumulative=score,
+        )
+        if step_type == environment.StepType.FIRST:
+            return environment.TimeStep(step_type, 0., 0., observation)
+        discount = 0. if step_type == environment.StepType.LAST else 1.
+        return environment.TimeStep(step_type, float(self._reward), discount, observation)
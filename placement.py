@@ -0,0 +1,225 @@
+"""
+building placement on an occupancy grid of the screen
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+The grid starts from the buildable layer of feature_screen, then the square footprint
+(x - radius .. x + radius) of every building and resource in feature_units is marked taken,
+and so is the lane between each CommandCenter and its mineral fields, to keep the workers' path clear.
+A summed-area table over the taken cells answers "is the footprint of size r at (x, y) free"
+with 4 lookups, the nearest free footprint is searched in windows growing around the point,
+so a query only reads the cells near it, not the whole screen.
+The grid is only rebuilt when a building or resource appears or disappears.
+
+Spots handed out are reserved until the building shows up there (or RESERVE_LOOPS passed),
+so a second SCV is not sent to a spot another one is walking to, while the same SCV
+ordered again gets its spot again.
+
+Usage:
+    placement = Placement()
+    pos = placement.find(obs, units.Terran.Barracks, near=[58, 33], builder=scv_tag) # [x, y], or None if nothing is free
+"""
+
+import numpy as np
+from pysc2.lib import features
+from pysc2.lib import units
+
+from . import unit_columns
+
+# half size of the footprints in screen pixels (84 x 84 screen)
+FOOTPRINT = {
+    units.Terran.CommandCenter: 9,
+    units.Terran.SupplyDepot: 4,
+    units.Terran.Barracks: 6,
+    units.Terran.Refinery: 5,
+}
+
+STRUCTURES = frozenset([
+    units.Terran.CommandCenter, units.Terran.OrbitalCommand, units.Terran.PlanetaryFortress,
+    units.Terran.SupplyDepot, units.Terran.SupplyDepotLowered, units.Terran.Barracks, units.Terran.Refinery,
+    units.Terran.EngineeringBay, units.Terran.Bunker, units.Terran.MissileTurret, units.Terran.SensorTower,
+    units.Terran.Factory, units.Terran.Starport, units.Terran.Armory, units.Terran.GhostAcademy,
+    units.Terran.FusionCore,
+] + [unit_type for unit_type in units.Neutral if "MineralField" in unit_type.name or "Geyser" in unit_type.name])
+
+MINERAL_FIELDS = frozenset(unit_type for unit_type in units.Neutral if "MineralField" in unit_type.name)
+
+MINERAL_LINE_RANGE = 30 # mineral fields this close to a CommandCenter are mined from it
+RESERVE_LOOPS = 672 # 30 seconds
+
+
+def _mark(taken, x0, y0, x1, y1):
+    """
+    :return changed: True if any cell x0 <= x < x1, y0 <= y < y1 is inside taken
+    """
+    height, width = taken.shape
+    x0, y0 = max(0, int(np.floor(x0))), max(0, int(np.floor(y0)))
+    x1, y1 = min(width, int(np.ceil(x1))), min(height, int(np.ceil(y1)))
+    if x0 < x1 and y0 < y1:
+        taken[y0:y1, x0:x1] = True
+        return True
+    return False
+
+
+class OccupancyGrid:
+    """
+    taken cells of the screen, indexed [y, x], with a summed-area table for footprint queries
+    """
+
+    def __init__(self, taken):
+        self.taken = np.array(taken, dtype=bool)
+        self._update()
+
+    def _update(self):
+        height, width = self.taken.shape
+        self._sat = np.zeros((height + 1, width + 1), dtype=np.int32)
+        self._sat[1:, 1:] = self.taken.cumsum(axis=0).cumsum(axis=1)
+
+    def mark(self, x0, y0, x1, y1):
+        """
+        mark the cells x0 <= x < x1, y0 <= y < y1 taken
+        """
+        if _mark(self.taken, x0, y0, x1, y1):
+            self._update()
+
+    def free(self, x, y, r):
+        """
+        check if the footprint of half size r centered at (x, y) is inside the screen and not taken
+        """
+        height, width = self.taken.shape
+        if x - r < 0 or y - r < 0 or x + r > width or y + r > height:
+            return False
+        s = self._sat
+        return s[y + r, x + r] - s[y - r, x + r] - s[y + r, x - r] + s[y - r, x - r] == 0
+
+    def free_centers(self, r, x0, y0, x1, y1):
+        """
+        :return free: [y1 - y0, x1 - x0] bool, free[y - y0, x - x0] is free(x, y, r),
+            for the centers r <= x0 <= x < x1 <= width + 1 - r, r <= y0 <= y < y1 <= height + 1 - r
+        """
+        s = self._sat
+        return s[y0 + r:y1 + r, x0 + r:x1 + r] - s[y0 - r:y1 - r, x0 + r:x1 + r] - \
+            s[y0 + r:y1 + r, x0 - r:x1 - r] + s[y0 - r:y1 - r, x0 - r:x1 - r] == 0
+
+    def nearest(self, pos, r):
+        """
+        :return pos: [x, y] of the free footprint of half size r closest to pos, if no, return None
+        """
+        height, width = self.taken.shape
+        x_end, y_end = width + 1 - r, height + 1 - r # centers are r <= x < x_end, r <= y < y_end
+        if x_end <= r or y_end <= r:
+            return None
+        px, py = pos[0], pos[1]
+        d = 2 * r + 1
+        while True:
+            # every center closer than d to pos is inside the window
+            x0, x1 = max(r, int(np.floor(px - d))), min(x_end, int(np.ceil(px + d)) + 1)
+            y0, y1 = max(r, int(np.floor(py - d))), min(y_end, int(np.ceil(py + d)) + 1)
+            whole = x0 == r and y0 == r and x1 == x_end and y1 == y_end
+            if x0 < x1 and y0 < y1:
+                ys, xs = np.nonzero(self.free_centers(r, x0, y0, x1, y1))
+                if len(xs):
+                    d2 = (xs + x0 - px) ** 2 + (ys + y0 - py) ** 2
+                    best = int(np.argmin(d2))
+                    if whole or d2[best] <= d * d + 1e-6:
+                        return [int(xs[best] + x0), int(ys[best] + y0)]
+                    d = np.sqrt(d2[best]) # a closer one can only be within this distance
+                    continue
+            if whole:
+                return None
+            d *= 2
+
+
+def _buildable(obs, shape):
+    """
+    :return buildable: buildable layer of feature_screen, everything if it is not observed
+    """
+    if "feature_screen" in obs.observation:
+        buildable = np.asarray(obs.observation.feature_screen[features.SCREEN_FEATURES.buildable.index]) != 0
+        # a screen without any buildable cell means the layer is not observed (e.g. a replayed trace)
+        if buildable.any():
+            return buildable
+    return np.ones(shape, dtype=bool)
+
+
+def _game_loop(obs):
+    if "game_loop" in obs.observation:
+        return int(obs.observation.game_loop[0])
+    return None
+
+
+class Placement:
+    """
+    occupancy grid of one env, rebuilt when the structures change, plus the spots handed out
+    """
+
+    def __init__(self):
+        self._signature = None
+        self._grid = None
+        self.reserved = [] # [x, y, r, game_loop it was handed out, tag of the builder, unit_type]
+
+    def grid(self, obs):
+        cols = unit_columns.UnitColumns(obs.observation.feature_units)
+        rows = np.flatnonzero(np.isin(cols.types, list(STRUCTURES)))
+        static = np.column_stack([cols.types[rows], cols.xs[rows], cols.ys[rows], cols.radius[rows]])
+        signature = static.tobytes()
+        dropped = self._drop_reserved(obs, static)
+        if signature != self._signature or dropped:
+            self._signature = signature
+            self._grid = self._build(obs, static)
+        return self._grid
+
+    def _build(self, obs, static):
+        if "feature_screen" in obs.observation:
+            shape = obs.observation.feature_screen.shape[1:]
+        else:
+            shape = (84, 84)
+        taken = ~_buildable(obs, shape)
+        for unit_type, x, y, r in static:
+            _mark(taken, x - r, y - r, x + r, y + r)
+        # lane between a CommandCenter and its mineral line
+        minerals = static[np.isin(static[:, 0], list(MINERAL_FIELDS))]
+        for unit_type, x, y, r in static[static[:, 0] == units.Terran.CommandCenter]:
+            line = minerals[np.hypot(minerals[:, 1] - x, minerals[:, 2] - y) <= MINERAL_LINE_RANGE]
+            if len(line):
+                _mark(taken, min(line[:, 1].min(), x), min(line[:, 2].min(), y),
+                      max(line[:, 1].max(), x), max(line[:, 2].max(), y))
+        for x, y, r, *_ in self.reserved:
+            _mark(taken, x - r, y - r, x + r, y + r)
+        return OccupancyGrid(taken)
+
+    def _drop_reserved(self, obs, static):
+        """
+        drop the spots a building showed up on, and the ones handed out too long ago
+        :return dropped: True if any spot was dropped
+        """
+        game_loop = _game_loop(obs)
+        kept = []
+        for spot in self.reserved:
+            x, y, r, loop = spot[:4]
+            built = np.any((np.abs(static[:, 1] - x) < r) & (np.abs(static[:, 2] - y) < r) &
+                           np.isin(static[:, 0], list(FOOTPRINT)))
+            expired = game_loop is not None and loop is not None and not loop <= game_loop < loop + RESERVE_LOOPS
+            if not built and not expired:
+                kept.append(spot)
+        dropped = len(kept) != len(self.reserved)
+        self.reserved = kept
+        return dropped
+
+    def find(self, obs, unit_type, near, builder=None):
+        """
+        :param builder: tag of the SCV that will build it, it gets the same spot while it has one reserved
+        :return pos: [x, y] of the free spot for unit_type closest to near, reserved for it, if no, return None
+        """
+        r = FOOTPRINT[unit_type]
+        grid = self.grid(obs)
+        if builder is not None:
+            for x, y, _, _, tag, reserved_type in self.reserved:
+                if tag == builder and reserved_type == unit_type:
+                    return [x, y]
+        pos = grid.nearest(near, r)
+        if pos is not None:
+            self.reserved.append([pos[0], pos[1], r, _game_loop(obs), builder, unit_type])
+            grid.mark(pos[0] - r, pos[1] - r, pos[0] + r, pos[1] + r)
+        return pos
@@ -0,0 +1,224 @@
+"""
+per tactic profiling of TacticAgent
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+For every tactic of possible_tactic_list (by Tactic.name), and for NO_TACTIC, the frames no tactic
+was executable on, it records:
+    selected        times the tactic was chosen
+    frames          frames the tactic sent an action on, no_op_frames: of them a no_op
+    durations       frames from choosing the tactic until the next tactic is chosen, as {frames: count}
+    check / select / exec latency: calls, total seconds and a histogram over LATENCY_BINS
+        (check includes the answers from the check cache)
+
+attach() shadows check_tactic, select_executer, exec_tactic, start_tactic and step_env of one agent
+with timed wrappers, an agent without profiler runs the plain methods, so profiling costs nothing when disabled.
+snapshot() returns the metrics since the profiler was reset. At the end of every episode the metrics
+since the end of the episode before (of any env) are appended to episodes, and to the json lines file path.
+
+Usage:
+    agent.profiler = profiling.TacticProfiler("metrics.jsonl")
+    ... run episodes ...
+    agent.profiler.snapshot() # {tactic name: metrics}
+    agent.profiler.episodes[-1]["tactics"] # {tactic name: metrics of the last episode}
+"""
+
+import bisect
+import collections
+import json
+import time
+
+import numpy as np
+from pysc2.lib import actions
+
+FUNCTIONS = actions.FUNCTIONS
+
+PHASES = ("check", "select", "exec")
+NO_TACTIC = "no_tactic" # name the frames no tactic was executable on are counted under
+LATENCY_BINS = np.logspace(-6, 0, 25).tolist() # upper edges in seconds, 1us .. 1s, the last bin is everything above
+
+
+class TacticStats:
+    __slots__ = ("selected", "frames", "no_op_frames", "durations", "calls", "seconds", "histograms")
+
+    def __init__(self):
+        self.selected = 0
+        self.frames = 0
+        self.no_op_frames = 0
+        self.durations = collections.Counter()
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.seconds = dict.fromkeys(PHASES, 0.)
+        self.histograms = {phase: [0] * (len(LATENCY_BINS) + 1) for phase in PHASES}
+
+    def copy(self):
+        return TacticStats() + self
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def _combine(self, other, sign):
+        stats = TacticStats()
+        stats.selected = self.selected + sign * other.selected
+        stats.frames = self.frames + sign * other.frames
+        stats.no_op_frames = self.no_op_frames + sign * other.no_op_frames
+        stats.durations = collections.Counter(self.durations)
+        for frames, cnt in other.durations.items():
+            stats.durations[frames] += sign * cnt
+        stats.durations = +stats.durations # drop the zero counts
+        for phase in PHASES:
+            stats.calls[phase] = self.calls[phase] + sign * other.calls[phase]
+            stats.seconds[phase] = self.seconds[phase] + sign * other.seconds[phase]
+            stats.histograms[phase] = [a + sign * b for a, b in zip(self.histograms[phase], other.histograms[phase])]
+        return stats
+
+    def record_latency(self, phase, seconds):
+        self.calls[phase] += 1
+        self.seconds[phase] += seconds
+        self.histograms[phase][bisect.bisect_left(LATENCY_BINS, seconds)] += 1
+
+    def snapshot(self):
+        latency = {}
+        for phase in PHASES:
+            calls = self.calls[phase]
+            latency[phase] = {
+                "calls": calls,
+                "mean": self.seconds[phase] / calls if calls else 0.,
+                "p50": percentile(self.histograms[phase], 0.5),
+                "p99": percentile(self.histograms[phase], 0.99),
+                "histogram": list(self.histograms[phase]),
+            }
+        return {
+            "selected": self.selected,
+            "frames": self.frames,
+            "no_op_frames": self.no_op_frames,
+            "no_op_rate": self.no_op_frames / self.frames if self.frames else 0.,
+            "durations": {str(frames): cnt for frames, cnt in sorted(self.durations.items())},
+            "latency": latency,
+        }
+
+
+def percentile(histogram, q):
+    """
+    :return seconds: upper edge of the bin the q-th call falls in, inf for the overflow bin, 0 without calls
+    """
+    total = sum(histogram)
+    if total == 0:
+        return 0.
+    rank = np.searchsorted(np.cumsum(histogram), q * total)
+    return LATENCY_BINS[rank] if rank < len(LATENCY_BINS) else float("inf")
+
+
+def _name(tactic_instance):
+    return tactic_instance.tactic.name
+
+
+class TacticProfiler:
+    """
+    metrics of the tactics of one TacticAgent, over all its envs
+    """
+
+    def __init__(self, path=None, clock=time.perf_counter):
+        self.path = path
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.stats = collections.defaultdict(TacticStats) # tactic name -> TacticStats
+        self.episodes = [] # snapshot at the end of every episode
+        self._running = {} # env -> [tactic name, frames] of the tactic chosen last
+        self._marks = {} # tactic name -> copy of its stats at the end of the last episode
+
+    def snapshot(self):
+        """
+        :return metrics: tactic name -> metrics, json serializable
+        """
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def interval_snapshot(self):
+        """
+        :return metrics: tactic name -> metrics since the last call, json serializable
+        """
+        metrics = {}
+        for name, stats in self.stats.items():
+            metrics[name] = (stats - self._marks.get(name, TacticStats())).snapshot()
+            self._marks[name] = stats.copy()
+        return metrics
+
+    def end_episode(self, i):
+        self._finish(i)
+        snapshot = {"env": i, "episode": len(self.episodes), "tactics": self.interval_snapshot()}
+        self.episodes.append(snapshot)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+    def _finish(self, i):
+        running = self._running.pop(i, None)
+        if running is not None:
+            self.stats[running[0]].durations[running[1]] += 1
+
+    def attach(self, agent):
+        """
+        shadow the tactic methods of agent with timed ones
+        """
+        cls = type(agent)
+        check_tactic = cls.check_tactic.__get__(agent)
+        select_executer = cls.select_executer.__get__(agent)
+        exec_tactic = cls.exec_tactic.__get__(agent)
+        start_tactic = cls.start_tactic.__get__(agent)
+        step_env = cls.step_env.__get__(agent)
+        clock = self.clock
+
+        def timed_check_tactic(idx, obs, quantities, i=0):
+            start = clock()
+            executable = check_tactic(idx, obs, quantities, i)
+            self.stats[_name(agent.env_tactics[i][idx])].record_latency("check", clock() - start)
+            return executable
+
+        def timed_select_executer(tactic, obs):
+            start = clock()
+            action = select_executer(tactic, obs)
+            self.stats[_name(tactic)].record_latency("select", clock() - start)
+            return action
+
+        def timed_exec_tactic(i, tactic, obs):
+            start = clock()
+            action = exec_tactic(i, tactic, obs)
+            self.stats[_name(tactic)].record_latency("exec", clock() - start)
+            return action
+
+        def counted_start_tactic(i, obs, start, quantities):
+            action = start_tactic(i, obs, start, quantities)
+            if action is not None:
+                self._finish(i)
+                name = _name(agent.env_tactics[i][agent.tactic_idx[i]])
+                self.stats[name].selected += 1
+                self._running[i] = [name, 0]
+            return action
+
+        def counted_step_env(i, obs):
+            action = step_env(i, obs)
+            frame_tactic = agent.frame_tactic[i]
+            stats = self.stats[_name(agent.env_tactics[i][frame_tactic]) if frame_tactic >= 0 else NO_TACTIC]
+            stats.frames += 1
+            stats.no_op_frames += action.function == FUNCTIONS.no_op.id
+            if i in self._running:
+                self._running[i][1] += 1
+            if obs.last():
+                self.end_episode(i)
+            return action
+
+        agent.check_tactic = timed_check_tactic
+        agent.select_executer = timed_select_executer
+        agent.exec_tactic = timed_exec_tactic
+        agent.start_tactic = counted_start_tactic
+        agent.step_env = counted_step_env
+
+    @staticmethod
+    def detach(agent):
+        for method in ("check_tactic", "select_executer", "exec_tactic", "start_tactic", "step_env"):
+            agent.__dict__.pop(method, None)
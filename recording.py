@@ -0,0 +1,262 @@
+"""
+record observation traces to disk and replay them without the game
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+A trace is a directory with a meta.json and chunks of .npy files.
+Each chunk holds up to chunk_steps steps in columnar layout:
+    <chunk>.units.npy           [n_unit_fields, n_units_in_chunk], one row per FeatureUnit field
+    <chunk>.unit_offsets.npy    [n_steps + 1], units of step i are columns offsets[i]:offsets[i + 1]
+    <chunk>.player.npy          [n_steps, n_player_fields]
+    <chunk>.actions.npy         available_actions of all steps, concatenated
+    <chunk>.action_offsets.npy  [n_steps + 1]
+    <chunk>.control_groups.npy  [n_steps, 10, 2]
+    <chunk>.game_loop.npy       [n_steps]
+    <chunk>.screen.npy          [n_frames, len(SCREEN_LAYERS), height, width], a frame is only stored
+                                when the layers changed since the step before
+    <chunk>.screen_index.npy    [n_steps], frame of every step
+    <chunk>.steps.npy           [n_steps, 4], step_type, reward, discount, env
+Observations of several envs (step_batch) are interleaved in one trace, the env column tells them apart.
+A replayed feature_screen holds the recorded layers, every other layer is 0.
+
+Usage:
+    agent.recorder = recording.ObservationRecorder("traces/BuildMarines")
+    ... run episodes ...
+    agent.recorder.close()
+
+    replayer = recording.ObservationReplayer("traces/BuildMarines")
+    recording.replay(final_agent_lzh.BuildMarines(), replayer)
+"""
+
+import json
+import os
+
+import numpy as np
+from pysc2.env import environment
+from pysc2.lib import features
+from pysc2.lib import named_array
+
+from . import unit_columns
+
+VERSION = 2
+SCREEN_LAYERS = ("buildable",) # feature_screen layers the agents read (placement.py)
+N_CONTROL_GROUPS = 10
+
+
+def _compact(array):
+    """
+    :return array: as int32 if all values fit, else int64
+    """
+    info = np.iinfo(np.int32)
+    if array.size == 0 or (array.min() >= info.min and array.max() <= info.max):
+        return array.astype(np.int32)
+    return array.astype(np.int64)
+
+def _screen_layers(feature_screen):
+    return np.stack([np.asarray(feature_screen[getattr(features.SCREEN_FEATURES, name).index])
+                     for name in SCREEN_LAYERS])
+
+class ObservationRecorder:
+    """
+    streams feature_units, player, available_actions, control_groups, game_loop and SCREEN_LAYERS
+    of each observation to a trace directory, only the current chunk is kept in memory
+    """
+
+    def __init__(self, path, chunk_steps=1024):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self._chunks = []
+        self._feature_screen_shape = None
+        self._clear()
+
+    def _clear(self):
+        self._units = []
+        self._player = []
+        self._actions = []
+        self._control_groups = []
+        self._game_loop = []
+        self._screen = [] # frames, a new one only when the layers changed
+        self._screen_index = []
+        self._steps = []
+
+    def record(self, obs, env=0):
+        """
+        :param env: index of the env obs comes from, for observations of several envs in one trace
+        """
+        observation = obs.observation
+        self._units.append(unit_columns.as_array(observation.feature_units))
+        self._player.append(np.asarray(observation.player))
+        self._actions.append(np.asarray(observation.available_actions))
+        if "control_groups" in observation:
+            self._control_groups.append(np.asarray(observation.control_groups))
+        else:
+            self._control_groups.append(np.zeros((N_CONTROL_GROUPS, 2), dtype=np.int64))
+        self._game_loop.append(int(observation.game_loop[0]) if "game_loop" in observation else 0)
+        if "feature_screen" in observation:
+            if self._feature_screen_shape is None:
+                self._feature_screen_shape = list(observation.feature_screen.shape)
+            layers = _screen_layers(observation.feature_screen)
+            if not self._screen or not np.array_equal(self._screen[-1], layers):
+                self._screen.append(layers)
+            self._screen_index.append(len(self._screen) - 1)
+        else:
+            self._screen_index.append(-1)
+        self._steps.append((int(obs.step_type), obs.reward or 0, obs.discount or 0, env))
+        if len(self._steps) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        if not self._steps:
+            return
+        name = "chunk_%05d" % len(self._chunks)
+        prefix = os.path.join(self.path, name)
+        units = np.concatenate(self._units)
+        np.save(prefix + ".units.npy", np.ascontiguousarray(_compact(units).T))
+        np.save(prefix + ".unit_offsets.npy", np.cumsum([0] + [len(u) for u in self._units]))
+        np.save(prefix + ".player.npy", _compact(np.stack(self._player)))
+        np.save(prefix + ".actions.npy", _compact(np.concatenate(self._actions)))
+        np.save(prefix + ".action_offsets.npy", np.cumsum([0] + [len(a) for a in self._actions]))
+        np.save(prefix + ".control_groups.npy", _compact(np.stack(self._control_groups)))
+        np.save(prefix + ".game_loop.npy", _compact(np.array(self._game_loop)))
+        if self._screen:
+            screen = _compact(np.stack(self._screen))
+        else:
+            screen = np.zeros([0, len(SCREEN_LAYERS)] + (self._feature_screen_shape or [0, 0, 0])[1:], dtype=np.int32)
+        np.save(prefix + ".screen.npy", screen)
+        np.save(prefix + ".screen_index.npy", np.array(self._screen_index, dtype=np.int32))
+        np.save(prefix + ".steps.npy", np.array(self._steps, dtype=np.float64))
+        self._chunks.append({"name": name, "steps": len(self._steps)})
+        self._clear()
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "version": VERSION,
+            "unit_fields": [f.name for f in features.FeatureUnit],
+            "player_fields": [f.name for f in features.Player],
+            "screen_layers": list(SCREEN_LAYERS),
+            "feature_screen_shape": self._feature_screen_shape,
+            "chunks": self._chunks,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *argv):
+        self.close()
+
+
+class ObservationReplayer:
+    """
+    memory-maps a trace written by ObservationRecorder,
+    observations are views into the mapped arrays, nothing is copied or loaded up front,
+    except feature_screen: the recorded layers are copied into a full screen once per frame
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != VERSION:
+            raise ValueError("Unsupported trace version: %s" % self.meta["version"])
+        self._chunks = []
+        for chunk in self.meta["chunks"]:
+            prefix = os.path.join(path, chunk["name"])
+            self._chunks.append({key: np.load(prefix + "." + key + ".npy", mmap_mode="r")
+                                 for key in ["units", "unit_offsets", "player", "actions", "action_offsets",
+                                             "control_groups", "game_loop", "screen", "screen_index", "steps"]})
+        self._chunk_starts = np.cumsum([0] + [c["steps"] for c in self.meta["chunks"]])
+        self._screen_shape = self.meta["feature_screen_shape"]
+        self._screen_rows = [getattr(features.SCREEN_FEATURES, name).index for name in self.meta["screen_layers"]]
+        self._screen_key = None # (chunk, frame) of _screen, consecutive steps mostly share their frame
+        self._screen = None
+
+    def __len__(self):
+        return int(self._chunk_starts[-1])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("step %d out of range" % i)
+        chunk_idx = int(np.searchsorted(self._chunk_starts, i, side="right")) - 1
+        return self._timestep(self._chunks[chunk_idx], i - self._chunk_starts[chunk_idx])
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            for j in range(len(chunk["steps"])):
+                yield self._timestep(chunk, j)
+
+    def episodes(self):
+        """
+        :return episodes: generator of lists of TimeSteps, one list per episode,
+            the steps of interleaved envs are split by their env
+        """
+        running = {} # env -> TimeSteps of its current episode
+        for chunk in self._chunks:
+            for j in range(len(chunk["steps"])):
+                env = int(chunk["steps"][j, 3])
+                timestep = self._timestep(chunk, j)
+                if timestep.first() and running.get(env):
+                    yield running.pop(env)
+                running.setdefault(env, []).append(timestep)
+        for episode in running.values():
+            yield episode
+
+    def observation_spec(self):
+        spec = {
+            "feature_units": (0, len(self.meta["unit_fields"])),
+            "player": (len(self.meta["player_fields"]),),
+            "available_actions": (0,),
+        }
+        spec["control_groups"] = (N_CONTROL_GROUPS, 2)
+        spec["game_loop"] = (1,)
+        if self._screen_shape:
+            spec["feature_screen"] = tuple(self._screen_shape)
+        return (spec,)
+
+    def _feature_screen(self, chunk, frame):
+        key = (id(chunk), frame)
+        if key != self._screen_key:
+            layers = chunk["screen"][frame]
+            screen = np.zeros(self._screen_shape, dtype=layers.dtype)
+            screen[self._screen_rows] = layers
+            self._screen = named_array.NamedNumpyArray(screen, [features.ScreenFeatures, None, None], copy=False)
+            self._screen_key = key
+        return self._screen
+
+    def _timestep(self, chunk, j):
+        u0, u1 = chunk["unit_offsets"][j], chunk["unit_offsets"][j + 1]
+        a0, a1 = chunk["action_offsets"][j], chunk["action_offsets"][j + 1]
+        observation = named_array.NamedDict(
+            feature_units=named_array.NamedNumpyArray(chunk["units"][:, u0:u1].T, [None, features.FeatureUnit], copy=False),
+            player=named_array.NamedNumpyArray(chunk["player"][j], [features.Player], copy=False),
+            available_actions=chunk["actions"][a0:a1],
+            control_groups=chunk["control_groups"][j],
+            game_loop=chunk["game_loop"][j:j + 1],
+        )
+        frame = int(chunk["screen_index"][j])
+        if frame >= 0:
+            observation["feature_screen"] = self._feature_screen(chunk, frame)
+        step_type, reward, discount, _ = chunk["steps"][j]
+        return environment.TimeStep(environment.StepType(int(step_type)), float(reward), float(discount), observation)
+
+
+def replay(agent, replayer, action_spec=None):
+    """
+    run agent over every episode of a trace
+    :return actions: list of the actions returned by the agent
+    """
+    agent.setup(replayer.observation_spec()[0], action_spec)
+    actions = []
+    for episode in replayer.episodes():
+        agent.reset()
+        for timestep in episode:
+            actions.append(agent.step(timestep))
+    return actions
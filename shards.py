@@ -0,0 +1,216 @@
+"""
+spatial index and route planner of mineral shards for CollectMineralShards
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Shards of a wave never move, they only disappear when collected,
+so the routes are planned once per wave:
+    split the shards between the marines (each marine takes its nearest ones, in equal shares)
+    nearest neighbor tour from each marine through its shards, then improved by 2-opt
+Every step afterwards only drops collected shards from the index and
+looks up the next shard on a marine's route.
+With queued commands, the next shards of a route are queued as waypoints of the marine,
+the marine is only sent again when it went idle or the shard it walks to is gone.
+"""
+
+import numpy as np
+
+MAX_TWO_OPT_PASSES = 4 # bounds a wave replan, later passes gain little (under 1% of the length at 200 shards)
+
+class ShardIndex:
+    """
+    uniform grid over the shards of one wave, shards are removed when they disappear
+    """
+
+    def __init__(self, tags, xy, cell_size=8):
+        self.tags = np.asarray(tags)
+        self.xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+        self.alive = np.ones(len(self.tags), dtype=bool)
+        self.cell_size = cell_size
+        self._cells = {}
+        for slot, cell in enumerate(map(tuple, (self.xy // cell_size).astype(np.int64))):
+            self._cells.setdefault(cell, []).append(slot)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def is_new_wave(self, tags):
+        """
+        check if tags holds a shard this index has never seen
+        """
+        return not np.all(np.isin(tags, self.tags))
+
+    def update(self, tags):
+        """
+        drop every shard not in tags
+        """
+        self.alive &= np.isin(self.tags, tags)
+
+    def remove(self, slot):
+        self.alive[slot] = False
+
+    def nearest(self, pos, mask=None):
+        """
+        :param mask: only consider shards with mask[slot] True
+        :return slot: of the closest alive shard to pos, if no, return None
+        """
+        candidates = self.alive if mask is None else self.alive & mask
+        if not candidates.any():
+            return None
+        cx, cy = int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+        best, best_d2 = None, np.inf
+        ring = 0
+        # rings of cells around pos, until no closer shard can be outside the rings searched
+        while (ring - 1) * self.cell_size < np.sqrt(best_d2):
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    if max(abs(dx), abs(dy)) != ring:
+                        continue
+                    for slot in self._cells.get((cx + dx, cy + dy), ()):
+                        if not candidates[slot]:
+                            continue
+                        d2 = (self.xy[slot, 0] - pos[0]) ** 2 + (self.xy[slot, 1] - pos[1]) ** 2
+                        if d2 < best_d2:
+                            best, best_d2 = slot, d2
+            ring += 1
+        return best
+
+    def pos(self, slot):
+        return [int(self.xy[slot, 0]), int(self.xy[slot, 1])]
+
+
+def split_shards(starts, xy):
+    """
+    give every shard to one marine, each marine takes its nearest shards until it has its share
+    :param starts: [n_marines, 2] marine positions
+    :param xy: [n_shards, 2] shard positions
+    :return owner: [n_shards] index of the marine of every shard
+    """
+    starts = np.asarray(starts, dtype=np.float64).reshape(-1, 2)
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    share = -(-len(xy) // len(starts))
+    distances = np.linalg.norm(xy[:, None, :] - starts[None, :, :], axis=2)
+    owner = np.full(len(xy), -1)
+    taken = np.zeros(len(starts), dtype=np.int64)
+    for flat in np.argsort(distances, axis=None, kind="stable"):
+        shard, marine = divmod(int(flat), len(starts))
+        if owner[shard] < 0 and taken[marine] < share:
+            owner[shard] = marine
+            taken[marine] += 1
+    return owner
+
+
+def two_opt(start, xy, route, max_passes=MAX_TWO_OPT_PASSES):
+    """
+    shorten an open path from start through xy[route] by reversing segments while that helps,
+    each pass tries every i once and applies its best reversal right away, at most max_passes passes
+    :return route: the improved route
+    """
+    route = list(route)
+    if len(route) < 3:
+        return route
+    path = np.vstack([np.asarray(start, dtype=np.float64), xy[route]])
+    n = len(path)
+    for _ in range(max_passes):
+        improved = False
+        # reverse path[i:j + 1], path[0] is the marine and stays in place
+        for i in range(1, n - 1):
+            j = np.arange(i + 1, n)
+            has_next = j + 1 < n
+            nxt = path[np.minimum(j + 1, n - 1)]
+            before = np.linalg.norm(path[i - 1] - path[i]) + np.linalg.norm(path[j] - nxt, axis=1) * has_next
+            after = np.linalg.norm(path[i - 1] - path[j], axis=1) + np.linalg.norm(path[i] - nxt, axis=1) * has_next
+            gain = before - after
+            best = int(np.argmax(gain))
+            if gain[best] > 1e-9:
+                k = int(j[best])
+                path[i:k + 1] = path[i:k + 1][::-1].copy()
+                route[i - 1:k] = route[i - 1:k][::-1]
+                improved = True
+        if not improved:
+            break
+    return route
+
+
+def plan_routes(index, starts):
+    """
+    :param index: ShardIndex of the wave
+    :param starts: [n_marines, 2] marine positions
+    :return routes: list of shard slots to visit in order, one list per marine
+    """
+    slots = np.flatnonzero(index.alive)
+    if len(starts) == 0:
+        return []
+    owner = split_shards(starts, index.xy[slots])
+    routes = []
+    for marine, start in enumerate(starts):
+        mask = np.zeros(len(index.alive), dtype=bool)
+        mask[slots[owner == marine]] = True
+        route = []
+        pos = start
+        while True:
+            slot = index.nearest(pos, mask)
+            if slot is None:
+                break
+            route.append(slot)
+            mask[slot] = False
+            pos = index.xy[slot]
+        routes.append(two_opt(start, index.xy, route))
+    return routes
+
+
+class ShardRoutes:
+    """
+    routes of the marines of one env through the current wave of shards
+    """
+
+    def __init__(self):
+        self.index = None
+        self.routes = {} # marine tag -> shard slots in visiting order
+        self.sent = {} # marine tag -> shard slot it was last sent to
+        self.queued = {} # marine tag -> shard slots of its queued waypoints, in order
+
+    def update(self, marine_tags, marine_xy, shard_tags, shard_xy):
+        """
+        drop collected shards, plan new routes when a new wave spawned
+        """
+        if self.index is None or self.index.is_new_wave(shard_tags):
+            self.index = ShardIndex(shard_tags, shard_xy)
+            self.routes = dict(zip([int(tag) for tag in marine_tags], plan_routes(self.index, marine_xy)))
+            self.sent = {}
+            self.queued = {}
+        else:
+            self.index.update(shard_tags)
+
+    def target(self, marine_tag, marine_xy):
+        """
+        :return slot: next alive shard on the marine's route,
+            the nearest alive shard once its route is done, if no shard is left, return None
+        """
+        route = self.routes.get(int(marine_tag), [])
+        while route and not self.index.alive[route[0]]:
+            route.pop(0)
+        if route:
+            return route[0]
+        return self.index.nearest(marine_xy)
+
+    def sync_queue(self, marine_tag, order_length):
+        """
+        drop the waypoints the marine is done with, its orders are the last order_length queued ones
+        :return stale: True if the marine has to be sent again: it is idle, its orders are not
+            the queued waypoints, or the shard it walks to is gone
+        """
+        queued = self.queued.setdefault(int(marine_tag), [])
+        del queued[:max(0, len(queued) - order_length)]
+        return len(queued) == 0 or len(queued) < order_length or not self.index.alive[queued[0]]
+
+    def next_waypoint(self, marine_tag):
+        """
+        :return slot: first alive shard of the marine's route that is not queued yet, if no, return None
+        """
+        queued = self.queued.get(int(marine_tag), [])
+        for slot in self.routes.get(int(marine_tag), []):
+            if self.index.alive[slot] and slot not in queued:
+                return slot
+        return None
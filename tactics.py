@@ -5,216 +5,486 @@ date: 2019.5.18
 license: MIT
 """
 
+import collections
+
 import numpy as np
 from pysc2.agents import base_agent
 from pysc2.lib import actions
 from pysc2.lib import features
 from pysc2.lib import units
 
+from . import harvest as harvest_lib
+from . import placement as placement_lib
+from . import unit_columns
+
 FUNCTIONS = actions.FUNCTIONS
 
 # class tactic
 # contains 3 functions:
 #   check_available_func
 #   select_executer_func
-#   exec_func
+#   exec_func, called with (obs, state), state is the EnvState of the env,
+#              returns an action, or a list of actions: the first is sent now, the rest on the next steps
+#              while the executer stays selected (e.g. queued Train_Marine_quick)
+#
+# depends_on: observation quantities check_available_func reads (see get_quantity),
+#             lets TacticAgent cache the check result until one of them changes,
+#             None if unknown, then the check is evaluated every time
+# executer:   Executer the select step picks, lets TacticAgent skip the select step
+#             when it is already selected, None if unknown
+# name:       for profiling, tracing and the benchmark, the tactics below carry the name of their variable
+#
+# a Tactic is a template shared by all agents and never modified,
+# every agent runs it through its own TacticInstance (see instantiate)
 class Tactic:
-    def __init__(self, check_available_func, select_executer_func, exec_func, once=False):
+    def __init__(self, check_available_func, select_executer_func, exec_func, once=False, depends_on=None,
+                 executer=None, name=None):
         self.func1 = check_available_func
         self.func2 = select_executer_func
         self.func3 = exec_func
-        self.add_func1 = lambda *argv: True
         self.once = once
+        self.depends_on = depends_on
+        self.executer = executer
+        self.name = name
+
+    def instantiate(self, additional_func=None, depends_on=None):
+        instance = TacticInstance(self)
+        if additional_func:
+            instance.add_additional_check_tactic_executable(additional_func, depends_on)
+        return instance
+
+def _always_true(*argv):
+    return True
+
+# per agent state of a tactic: the agent's additional check and whether a once-tactic was execed
+class TacticInstance:
+    __slots__ = ("tactic", "add_func1", "add_depends_on", "execed")
+
+    def __init__(self, tactic):
+        self.tactic = tactic
+        self.add_func1 = _always_true
+        self.add_depends_on = ()
         self.execed = False
 
+    def copy(self):
+        instance = TacticInstance(self.tactic)
+        instance.add_func1 = self.add_func1
+        instance.add_depends_on = self.add_depends_on
+        return instance
+
     def check_tactic_executable(self, *argv):
-        if self.once:
+        if self.tactic.once:
             if self.execed:
                 return False
             else:
                 self.execed = True
-        return self.func1(*argv) and self.add_func1(*argv)
+        return self.tactic.func1(*argv) and self.add_func1(*argv)
 
     def select_executer_func(self, *argv):
-        return self.func2(*argv)
+        return self.tactic.func2(*argv)
 
     def exec_func(self, *argv):
-        return self.func3(*argv)
+        return self.tactic.func3(*argv)
 
-    def add_additional_check_tactic_executable(self, additional_func):
+    def add_additional_check_tactic_executable(self, additional_func, depends_on=None):
         self.add_func1 = additional_func
+        self.add_depends_on = depends_on
+
+    def check_depends_on(self):
+        """
+        :return keys: quantities check_tactic_executable depends on, None if the result can't be cached
+        """
+        if self.tactic.once or self.tactic.depends_on is None or self.add_depends_on is None:
+            return None
+        return tuple(self.tactic.depends_on) + tuple(self.add_depends_on)
+
+_TYPE_STRIDE = 1 << 16 # unit_type ids are below this
+
+def stack_feature_units(feature_units_list):
+    """
+    :return stacked: feature_units of all observations concatenated
+    :return env: index into feature_units_list of every row of stacked
+    :return offsets: rows of observation i are stacked[offsets[i]:offsets[i + 1]]
+    """
+    arrays = [unit_columns.as_array(fu) for fu in feature_units_list]
+    lengths = [len(a) for a in arrays]
+    stacked = np.concatenate(arrays) if arrays else np.zeros((0, unit_columns.N_FIELDS), dtype=np.int64)
+    env = np.repeat(np.arange(len(arrays), dtype=np.int64), lengths)
+    return stacked, env, np.cumsum([0] + lengths)
+
+# unit index
+# built once per observation with one vectorized pass over feature_units,
+# every helper below reads from it instead of re-walking the unit list,
+# the raw columns (types, xy, ...) are views into feature_units (see unit_columns.py)
+class UnitIndex:
+    _columns = ["types", "tags", "alliance", "health", "order_length", "radius", "xy", "selected",
+                "idle", "busy", "enemy", "neutral", "own"]
+
+    def __init__(self, feature_units):
+        self._set_columns(feature_units)
+        unit_types, counts = np.unique(self.types, return_counts=True)
+        self.counts = dict(zip(unit_types.tolist(), counts.tolist()))
+        self._type_idx = {}
+
+    def _set_columns(self, fu):
+        cols = unit_columns.UnitColumns(fu)
+        self.types = cols.types
+        self.tags = cols.tags
+        self.alliance = cols.alliance
+        self.health = cols.health
+        self.order_length = cols.order_length
+        self.radius = cols.radius
+        self.xy = cols.xy
+        self.selected = cols.is_selected != 0
+
+        self.idle = self.order_length == 0
+        self.busy = ~self.idle
+        self.enemy = self.alliance == features.PlayerRelative.ENEMY
+        self.neutral = self.alliance == features.PlayerRelative.NEUTRAL
+        self.own = self.alliance == features.PlayerRelative.SELF
+
+    @classmethod
+    def batch(cls, feature_units_list):
+        """
+        build the indexes of many observations in one vectorized pass over their stacked feature_units,
+        the index of each observation holds views into the stacked arrays
+        """
+        stacked, env, offsets = stack_feature_units(feature_units_list)
+        whole = cls.__new__(cls)
+        whole._set_columns(stacked)
+        # counts of every (env, unit_type) at once
+        keys, counts = np.unique(env * _TYPE_STRIDE + whole.types, return_counts=True)
+        bounds = np.searchsorted(keys // _TYPE_STRIDE, np.arange(len(feature_units_list) + 1))
+        indexes = []
+        for i in range(len(feature_units_list)):
+            index = cls.__new__(cls)
+            for name in cls._columns:
+                setattr(index, name, getattr(whole, name)[offsets[i]:offsets[i + 1]])
+            k0, k1 = bounds[i], bounds[i + 1]
+            index.counts = dict(zip((keys[k0:k1] % _TYPE_STRIDE).tolist(), counts[k0:k1].tolist()))
+            index._type_idx = {}
+            indexes.append(index)
+        return indexes
+
+    def count(self, unit_type):
+        return self.counts.get(int(unit_type), 0)
+
+    def type_idx(self, unit_type):
+        """
+        :return idx: positions in feature_units of all units of unit_type, in scan order
+        """
+        unit_type = int(unit_type)
+        if unit_type not in self._type_idx:
+            self._type_idx[unit_type] = np.flatnonzero(self.types == unit_type)
+        return self._type_idx[unit_type]
+
+    def positions(self, unit_type):
+        return self.xy[self.type_idx(unit_type)]
+
+    def pos(self, i):
+        return [int(self.xy[i, 0]), int(self.xy[i, 1])]
+
+    def first(self, unit_type, mask=None):
+        """
+        :return pos: [x, y] of the first unit of unit_type (optionally also matching mask), if no, return None
+        """
+        idx = self.type_idx(unit_type)
+        if mask is not None:
+            idx = idx[mask[idx]]
+        if len(idx) == 0:
+            return None
+        return self.pos(idx[0])
+
+    def last(self, unit_type):
+        idx = self.type_idx(unit_type)
+        if len(idx) == 0:
+            return None
+        return self.pos(idx[-1])
+
+    def least_busy(self, unit_type):
+        """
+        :return pos: [x, y] of the unit of unit_type with fewest orders queued, if no, return None
+        """
+        idx = self.type_idx(unit_type)
+        if len(idx) == 0:
+            return None
+        return self.pos(idx[np.argmin(self.order_length[idx])])
+
+# the index of an observation is kept on its feature_units array (a NamedNumpyArray everywhere the agents run),
+# so it lives exactly as long as the observation and agents or threads never see each other's indexes,
+# a plain ndarray has no __dict__, its index is rebuilt on every call
+def _cache_unit_index(feature_units, index):
+    attrs = getattr(feature_units, "__dict__", None)
+    if attrs is not None:
+        attrs["_unit_index"] = index
+    return index
+
+def get_unit_index(obs):
+    feature_units = obs.observation.feature_units
+    attrs = getattr(feature_units, "__dict__", None)
+    index = attrs.get("_unit_index") if attrs is not None else None
+    if index is None:
+        index = _cache_unit_index(feature_units, UnitIndex(feature_units))
+    return index
+
+def clear_unit_index(obs):
+    """
+    drop the index kept on obs, the next helper called on it builds it again (e.g. to time that)
+    """
+    getattr(obs.observation.feature_units, "__dict__", {}).pop("_unit_index", None)
+
+def index_units_batch(obs_list):
+    """
+    build the unit indexes of a batch of observations (one per env) together,
+    so the helpers called on each of them afterwards find it cached
+    """
+    feature_units_list = [obs.observation.feature_units for obs in obs_list]
+    indexes = UnitIndex.batch(feature_units_list)
+    for feature_units, index in zip(feature_units_list, indexes):
+        _cache_unit_index(feature_units, index)
+    return indexes
 
 def get_unit_cnt(obs, unit_type):
-    cnt = 0
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == unit_type:
-            cnt += 1
-    return cnt
+    return get_unit_index(obs).count(unit_type)
 
 def get_one_idle_scv(obs):
     """
     check if any idle scv are available
     :return idle_scv_pos: [x, y], if no, return None
     """
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.SCV and int(unit.order_length) == 0:
-            return [unit.x, unit.y]
-    return None
+    index = get_unit_index(obs)
+    return index.first(units.Terran.SCV, index.idle)
 
 def get_one_idle_marine(obs):
     """
     check if any idle marine are available
     :return idle_scv_pos: [x, y], if no, return None
     """
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.Marine and int(unit.order_length) == 0:
-            return [unit.x, unit.y]
-    return None
+    index = get_unit_index(obs)
+    return index.first(units.Terran.Marine, index.idle)
 
 def get_busy_marine_cnt(obs):
-    cnt = 0
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.Marine and int(unit.order_length) != 0:
-            cnt += 1
-    return cnt
+    index = get_unit_index(obs)
+    return int(np.count_nonzero(index.busy[index.type_idx(units.Terran.Marine)]))
 
 def get_idle_marine_cnt(obs):
-    cnt = 0
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.Marine and int(unit.order_length) == 0:
-            cnt += 1
-    return cnt
+    index = get_unit_index(obs)
+    return int(np.count_nonzero(index.idle[index.type_idx(units.Terran.Marine)]))
 
 def get_one_random_scv(obs):
     a = get_one_idle_scv(obs)
     if a:
         return a
     else:
-        for unit in obs.observation.feature_units:
-            if unit.unit_type == units.Terran.SCV:
-                return [unit.x, unit.y]
-
-def get_minerals_positions(obs):
-    res = []
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Neutral.MineralField:
-            return [unit.x, unit.y]
-
-def get_mineralshards_positions(obs):
-    pos = get_one_idle_marine(obs)
-    res = []
-    for unit in obs.observation.feature_units:
-        if unit.alliance == features.PlayerRelative.NEUTRAL:
-            res.append([unit.x, unit.y])
-    distances = np.linalg.norm(np.array(res) - np.array(pos), axis=1)
-    closest_mineral_xy = res[np.argmin(distances)]
-    return closest_mineral_xy
+        return get_unit_index(obs).first(units.Terran.SCV)
+
+def get_selected_scv(obs):
+    """
+    :return i: position in feature_units of the first selected scv, if no, return None
+    """
+    index = get_unit_index(obs)
+    idx = np.flatnonzero(index.selected & (index.types == units.Terran.SCV))
+    return int(idx[0]) if len(idx) else None
+
+# state: EnvState of the env, if given, the selected scv goes to the least saturated resource of its base
+def get_minerals_positions(obs, state=None):
+    scv = get_selected_scv(obs)
+    if state is None or scv is None:
+        return get_unit_index(obs).first(units.Neutral.MineralField)
+    return state.harvest.target(obs, scv)
 
 # get command center with fewer orders queued
 # command center is in [33, 33], radius = 9 for BuildMarine and CollectMineralsAndGas
 def get_command_center_positions(obs):
-    order_len = 999
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.CommandCenter and unit.order_length < order_len:
-            pos = [unit.x, unit.y]
-            r = unit.radius
-            order_len = unit.order_length
-    return pos
+    return get_unit_index(obs).least_busy(units.Terran.CommandCenter)
 
 # get new command center position
-def get_new_command_center_position(obs):
-    x, y, r = None, None, None
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.CommandCenter:
-            x, y = unit.x, unit.y
-            r = unit.radius
+def get_new_command_center_position(obs, state=None):
+    index = get_unit_index(obs)
+    i = index.type_idx(units.Terran.CommandCenter)[-1]
+    x, y = index.pos(i)
+    r = int(index.radius[i])
     if x < 42:
         x = x + 2 * r
     else:
         x = x - 2 * r
-    return [x, y]
+    return find_placement(obs, units.Terran.CommandCenter, [x, y], state)
 
 # radius = 6
 def get_barracks_position(obs):
-    order_len = 999
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Terran.Barracks and unit.order_length < order_len:
-            pos = [unit.x, unit.y]
-            order_len = unit.order_length
-    return pos
+    return get_unit_index(obs).least_busy(units.Terran.Barracks)
 
 def get_enemy_pos(obs):
-    min_health = 99999
-    pos = [0, 0]
-    for unit in obs.observation.feature_units:
-        if unit.alliance == features.PlayerRelative.ENEMY and unit.health < min_health:
-            pos = [unit.x, unit.y]
-            min_health = unit.health
-    return pos
-
-def get_enemy_pos_y_min_max(obs):
-    y_min = 888
-    y_max = 0
-    for unit in obs.observation.feature_units:
-        if unit.alliance == features.PlayerRelative.ENEMY:
-            if unit.y < y_min:
-                y_min = unit.y
-                min_pos = [unit.x, unit.y - 20]
-            if unit.y > y_max:
-                y_max = unit.y
-                max_pos = [unit.x, unit.y + 20]
-    return [min_pos, max_pos]
-
-# get potential supply depot pos
-def get_potential_supply_depot_pos(obs):
-    potential_barracks_pos = []
-    for x in [22, 30, 38, 46]:
-        for y in [12, 20, 46, 54]:
-            potential_barracks_pos.append([int(x), int(y)])
-    idx = get_unit_cnt(obs, units.Terran.SupplyDepot)
-    if idx > len(potential_barracks_pos) - 1:
-        for unit in obs.observation.feature_units:
-            if unit.unit_type == units.Terran.CommandCenter:
-                x, y = unit.x, unit.y
-                r = unit.radius
-                delta_x = np.random.randint(-4 * r, r)
-                delta_y = np.random.randint(-4 * r, 4 * r)
-                return [x + delta_x, y + delta_y]
-    else:
-        return potential_barracks_pos[idx]
-
-
-def get_potential_barracks_pos(obs):
-    # for unit in obs.observation.feature_units:
-    #     if unit.unit_type == units.Terran.CommandCenter:
-    #         x, y = unit.x, unit.y
-    #         r = unit.radius
-    #         delta_x = np.random.randint(r, 5 * r)
-    #         delta_y = np.random.randint(-3 * r, 3 * r)
-    #         return [x + delta_x, y + delta_y]
-
-    potential_barracks_pos = []
-    for x in [56, 69, 72]:
-        for y in [7, 22, 37, 52]:
-            potential_barracks_pos.append([int(x), int(y)])
-    return potential_barracks_pos[get_unit_cnt(obs, units.Terran.Barracks)]
-    # return [0, 0]
-
-def get_zerg_pos(obs):
-    min_health = 99999
-    pos = [0, 0]
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Zerg.Zergling:
-            pos = [unit.x, unit.y]
-            min_health = unit.health
-    return pos
-
-def get_baneling_pos(obs):
-    pos = [0, 0]
-    for unit in obs.observation.feature_units:
-        if unit.unit_type == units.Zerg.Baneling:
-            pos = [unit.x, unit.y]
-            return pos
+    index = get_unit_index(obs)
+    idx = np.flatnonzero(index.enemy)
+    if len(idx) == 0:
+        return [0, 0]
+    return index.pos(idx[np.argmin(index.health[idx])])
+
+# building spots
+# state: EnvState of the env, its placement keeps the spots already handed out to SCVs on their way,
+#        if None, only the buildings already on the screen are avoided
+def find_placement(obs, unit_type, near, state=None):
+    """
+    :return pos: [x, y] of the free spot for unit_type closest to near, if no, return None
+    """
+    placement = state.placement if state is not None else placement_lib.Placement()
+    scv = get_selected_scv(obs)
+    builder = int(get_unit_index(obs).tags[scv]) if scv is not None else None
+    return placement.find(obs, unit_type, near, builder)
+
+def get_base_anchor(obs, distance):
+    """
+    :return pos: [x, y] distance away from the first command center, on the side away from its minerals
+    """
+    index = get_unit_index(obs)
+    cc = index.type_idx(units.Terran.CommandCenter)
+    if len(cc) == 0:
+        return [obs.observation.feature_screen.shape[2] // 2, obs.observation.feature_screen.shape[1] // 2]
+    base = index.xy[cc[0]].astype(np.float64)
+    minerals = index.positions(units.Neutral.MineralField)
+    if len(minerals) == 0 or distance == 0:
+        return [int(base[0]), int(base[1])]
+    away = base - minerals.mean(axis=0)
+    away /= max(np.linalg.norm(away), 1e-6)
+    return [int(base[0] + away[0] * distance), int(base[1] + away[1] * distance)]
+
+# get potential supply depot pos, next to the command center
+def get_potential_supply_depot_pos(obs, state=None):
+    return find_placement(obs, units.Terran.SupplyDepot, get_base_anchor(obs, 0), state)
+
+# get potential barracks pos, in front of the command center
+def get_potential_barracks_pos(obs, state=None):
+    return find_placement(obs, units.Terran.Barracks, get_base_anchor(obs, 25), state)
+
+def screen_action(obs, function, get_pos, *argv):
+    """
+    :param get_pos: called with (obs, *argv) only if function is available,
+        as finding a position can reserve a building spot or assign an scv to a resource
+    :return action: function at the position, no_op if it is not available or there is no position
+    """
+    if function.id not in obs.observation.available_actions:
+        return FUNCTIONS.no_op()
+    pos = get_pos(obs, *argv)
+    if pos is None:
+        return FUNCTIONS.no_op()
+    return function("now", make_save_pos(obs, pos))
+
+MAX_QUEUE = 5 # units a building can have queued
+TRAIN_COST = {units.Terran.SCV: 50, units.Terran.Marine: 50} # minerals, every unit takes 1 food
+PLAN_LENGTH = 5 # actions a tactic queues at most
+
+def train_plan(obs, function, producer, unit_type):
+    """
+    :return actions: function once for every unit the selected producers can queue now,
+        limited by minerals, food and their free queue slots, no_op if function is not available
+    """
+    if function.id not in obs.observation.available_actions:
+        return FUNCTIONS.no_op()
+    index = get_unit_index(obs)
+    producers = index.selected & (index.types == producer)
+    slots = int(np.sum(np.maximum(MAX_QUEUE - index.order_length[producers], 0)))
+    player = obs.observation.player
+    food = int(player[features.Player.food_cap] - player[features.Player.food_used])
+    cnt = min(slots, int(player[features.Player.minerals]) // TRAIN_COST[unit_type], food, PLAN_LENGTH)
+    return [function("now")] + [function("queued")] * (cnt - 1)
+
+GEYSERS = frozenset(unit_type for unit_type in units.Neutral if "Geyser" in unit_type.name)
+
+def get_free_geyser_pos(obs):
+    """
+    :return pos: [x, y] of the geyser without refinery closest to a command center, if no, return None
+    """
+    index = get_unit_index(obs)
+    geysers = np.flatnonzero(np.isin(index.types, list(GEYSERS)))
+    refineries = index.positions(units.Terran.Refinery)
+    bases = index.positions(units.Terran.CommandCenter)
+    if len(geysers) == 0 or len(bases) == 0:
+        return None
+    taken = (np.abs(index.xy[geysers][:, None, :] - refineries[None, :, :]) <= 1).all(axis=2).any(axis=1)
+    geysers = geysers[~taken]
+    if len(geysers) == 0:
+        return None
+    distances = np.linalg.norm(index.xy[geysers][:, None, :] - bases[None, :, :], axis=2).min(axis=1)
+    return index.pos(geysers[np.argmin(distances)])
+
+# executer of a tactic
+#   unit_type: type of the executer
+#   idle:      the executer must be one idle unit (like get_one_idle_scv), else any units of unit_type
+#   group:     control group holding all units of unit_type, recalled instead of clicking on one
+#   all_units: all units of unit_type must be selected (like select_army)
+Executer = collections.namedtuple("Executer", ["unit_type", "idle", "group", "all_units"])
+Executer.__new__.__defaults__ = (False, None, False)
+
+def executer_selected(obs, executer):
+    """
+    check if the current selection can execute a tactic with this executer right away
+    """
+    index = get_unit_index(obs)
+    idx = index.type_idx(executer.unit_type)
+    selected = index.selected[idx]
+    n_selected = np.count_nonzero(selected)
+    if n_selected == 0 or n_selected != np.count_nonzero(index.selected):
+        return False
+    if executer.idle:
+        return n_selected == 1 and bool(index.idle[idx[selected]][0])
+    if executer.all_units:
+        return n_selected == len(idx)
+    return True
+
+def control_group_current(obs, executer):
+    """
+    check if the control group of executer holds all units of its type
+    """
+    if executer.group is None or "control_groups" not in obs.observation:
+        return False
+    unit_type, cnt = obs.observation.control_groups[executer.group]
+    return unit_type == executer.unit_type and cnt == get_unit_cnt(obs, executer.unit_type)
+
+# per env state the exec functions keep across steps, TacticAgent passes it to exec_func
+class EnvState:
+    __slots__ = ("placement", "harvest")
+
+    def __init__(self):
+        self.placement = placement_lib.Placement() # building spots handed out
+        self.harvest = harvest_lib.Harvest() # resource every scv was sent to
+
+# phase of a step of TacticAgent, recorded by tracing.DecisionTracer
+PHASE_PLAN = 0 # next action of the plan of the current tactic
+PHASE_SELECT = 1 # select step of a new tactic
+PHASE_EXEC = 2 # exec step
+PHASE_FALL_THROUGH = 3 # exec step was a no_op, the frame went to the next tactic
+PHASE_NO_TACTIC = 4 # no tactic was executable
+PHASE_CONTROL_GROUP = 5 # no_op frame spent on setting a control group
+PHASES = ("plan", "select", "exec", "fall_through", "no_tactic", "control_group")
+
+_SELECT_FUNCTIONS = frozenset(f.id for f in FUNCTIONS if f.name.startswith("select_"))
+
+def action_phase(action):
+    """
+    :return phase: of an action of an agent without tactics, from its function
+    """
+    if action.function == FUNCTIONS.no_op.id:
+        return PHASE_NO_TACTIC
+    return PHASE_SELECT if action.function in _SELECT_FUNCTIONS else PHASE_EXEC
+
+# observation quantities tactic checks can depend on
+QUANTITIES = {
+    "minerals": lambda obs: int(obs.observation.player[features.Player.minerals]),
+    "food_cap": lambda obs: int(obs.observation.player[features.Player.food_cap]),
+    "food_used": lambda obs: int(obs.observation.player[features.Player.food_used]),
+    "idle_scv": lambda obs: get_one_idle_scv(obs) is not None,
+    "idle_marine": lambda obs: get_one_idle_marine(obs) is not None,
+    "busy_marine_cnt": lambda obs: get_busy_marine_cnt(obs),
+}
+
+def get_quantity(obs, key):
+    """
+    :param key: name in QUANTITIES, or a unit_type for the count of that unit type
+    """
+    if isinstance(key, str):
+        return QUANTITIES[key](obs)
+    return get_unit_cnt(obs, key)
 
 def food_cap_equal_used(obs):
     return obs.observation.player[features.Player.food_cap] == obs.observation.player[features.Player.food_used]
@@ -232,32 +502,50 @@ def make_save_pos(obs, pos):
 tactic_build_command_center = Tactic(
     lambda obs, *argv: obs.observation.player[features.Player.minerals] >= 450,
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_random_scv(obs))),
-    lambda obs, *argv: FUNCTIONS.Build_CommandCenter_screen("now", make_save_pos(obs, get_new_command_center_position(obs))) \
-                       if FUNCTIONS.Build_CommandCenter_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: screen_action(obs, FUNCTIONS.Build_CommandCenter_screen, get_new_command_center_position, *argv),
+    depends_on=("minerals",),
+    executer=Executer(units.Terran.SCV, idle=True),
+    name="tactic_build_command_center"
 )
 
 # build supply depot
 tactic_build_supply_depot = Tactic(
     lambda obs, *argv: obs.observation.player[features.Player.minerals] >= 100,
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_random_scv(obs))),
-    lambda obs, *argv: FUNCTIONS.Build_SupplyDepot_screen("now", make_save_pos(obs, get_potential_supply_depot_pos(obs))) \
-                       if FUNCTIONS.Build_SupplyDepot_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: screen_action(obs, FUNCTIONS.Build_SupplyDepot_screen, get_potential_supply_depot_pos, *argv),
+    depends_on=("minerals",),
+    executer=Executer(units.Terran.SCV, idle=True),
+    name="tactic_build_supply_depot"
 )
 
 # tactic build barracks
 tactic_build_barracks = Tactic(
     lambda obs, *argv: obs.observation.player[features.Player.minerals] >= 150,
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_random_scv(obs))),
-    lambda obs, *argv: FUNCTIONS.Build_Barracks_screen("now", make_save_pos(obs, get_potential_barracks_pos(obs))) \
-                       if FUNCTIONS.Build_Barracks_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: screen_action(obs, FUNCTIONS.Build_Barracks_screen, get_potential_barracks_pos, *argv),
+    depends_on=("minerals",),
+    executer=Executer(units.Terran.SCV, idle=True),
+    name="tactic_build_barracks"
+)
+
+# build refinery on a free geyser
+tactic_build_refinery = Tactic(
+    lambda obs, *argv: obs.observation.player[features.Player.minerals] >= 75,
+    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_random_scv(obs))),
+    lambda obs, *argv: screen_action(obs, FUNCTIONS.Build_Refinery_screen, get_free_geyser_pos),
+    depends_on=("minerals",),
+    executer=Executer(units.Terran.SCV, idle=True),
+    name="tactic_build_refinery"
 )
 
 # harvest mineral
 tactic_harvest_mineral = Tactic(
     lambda obs, *argv: get_one_idle_scv(obs),
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_scv(obs))),
-    lambda obs, *argv: FUNCTIONS.Harvest_Gather_screen("now", make_save_pos(obs, get_minerals_positions(obs))) \
-                       if FUNCTIONS.Harvest_Gather_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: screen_action(obs, FUNCTIONS.Harvest_Gather_screen, get_minerals_positions, *argv),
+    depends_on=("idle_scv",),
+    executer=Executer(units.Terran.SCV, idle=True),
+    name="tactic_harvest_mineral"
 )
 
 # train scv
@@ -266,8 +554,10 @@ tactic_train_scv = Tactic(
                        get_unit_cnt(obs, units.Terran.CommandCenter) >= 1 and \
                        obs.observation.player[features.Player.minerals] >= 50,
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_command_center_positions(obs))),
-    lambda obs, *argv: FUNCTIONS.Train_SCV_quick("now") \
-                       if FUNCTIONS.Train_SCV_quick.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: train_plan(obs, FUNCTIONS.Train_SCV_quick, units.Terran.CommandCenter, units.Terran.SCV),
+    depends_on=("food_cap", "food_used", units.Terran.CommandCenter, "minerals"),
+    executer=Executer(units.Terran.CommandCenter, group=1),
+    name="tactic_train_scv"
 )
 
 tactic_train_marine = Tactic(
@@ -275,63 +565,17 @@ tactic_train_marine = Tactic(
                        get_unit_cnt(obs, units.Terran.Barracks) >= 1 and \
                        obs.observation.player[features.Player.minerals] >= 50,
     lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_barracks_position(obs))),
-    lambda obs, *argv: FUNCTIONS.Train_Marine_quick("now") \
-                       if FUNCTIONS.Train_Marine_quick.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-# collect mineral shards
-tactic_collect_mineralshards = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Move_screen("now", make_save_pos(obs, get_mineralshards_positions(obs))) \
-                       if FUNCTIONS.Move_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_attack_zerg_pioneer = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Attack_screen("now", make_save_pos(obs, get_zerg_pos(obs))) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_attack_baneling_pioneer = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Attack_screen("now", make_save_pos(obs, get_baneling_pos(obs))) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_attack_all = Tactic(
-    lambda obs, *argv: True,
-    lambda obs, *argv: FUNCTIONS.select_army("select"),
-    lambda obs, *argv: FUNCTIONS.Attack_screen("now", make_save_pos(obs, get_enemy_pos_y_min_max(obs)[0])) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_attack_zerg_all = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Attack_screen("now", make_save_pos(obs, get_zerg_pos(obs))) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_move_to_enemy_top = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Move_screen("now", make_save_pos(obs, get_enemy_pos_y_min_max(obs)[0])) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
-)
-
-tactic_move_to_enemy_bottom = Tactic(
-    lambda obs, *argv: get_one_idle_marine(obs),
-    lambda obs, *argv: FUNCTIONS.select_point("select", make_save_pos(obs, get_one_idle_marine(obs))),
-    lambda obs, *argv: FUNCTIONS.Move_screen("now", make_save_pos(obs, get_enemy_pos_y_min_max(obs)[1])) \
-                       if FUNCTIONS.Attack_screen.id in obs.observation.available_actions else FUNCTIONS.no_op()
+    lambda obs, *argv: train_plan(obs, FUNCTIONS.Train_Marine_quick, units.Terran.Barracks, units.Terran.Marine),
+    depends_on=("food_cap", "food_used", units.Terran.Barracks, "minerals"),
+    executer=Executer(units.Terran.Barracks, group=2),
+    name="tactic_train_marine"
 )
 
 # no op
 tactic_no_op = Tactic(
     lambda *argv: True,
     lambda *argv: FUNCTIONS.no_op(),
-    lambda *argv: FUNCTIONS.no_op()
+    lambda *argv: FUNCTIONS.no_op(),
+    depends_on=(),
+    name="tactic_no_op"
 )
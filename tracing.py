@@ -0,0 +1,211 @@
+"""
+decision trace of TacticAgent, a ring buffer of the last steps of every env for post-mortem analysis
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+Every step writes one int32 row of FIELDS into a preallocated [n_envs, capacity, len(FIELDS)] ring:
+the tactic chosen (its index in possible_tactic_list, -1 if none), the phase it was in, the function id
+and flattened arguments of the action sent, and a few player scalars. The rings are allocated once,
+a step only builds its row as a short python list and assigns it in one go (cheaper than numpy field by field).
+The last capacity rows of an env are flushed at the end of its episode, or on an anomaly:
+    no_op_streak    anomaly_streak wasted no_op frames in a row
+    zero_target     a screen action sent to [0, 0], where the position helpers point when they find nothing
+Flushing copies the rows in step order and hands them to a background thread, which writes
+    <path>/meta.json                                  fields, phases and tactic names
+    <path>/env<i>_ep<episode>_<step>_<reason>.npy     [n_rows, len(FIELDS)], int16 if all values fit
+
+Usage:
+    agent.tracer = tracing.DecisionTracer("traces/DefeatZerglingsAndBanelings")
+    ... run episodes ...
+    agent.tracer.close()
+    python -m pysc2.agents.tracing traces/DefeatZerglingsAndBanelings/env0_ep00003_000412_episode.npy
+"""
+
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+from pysc2.lib import actions
+from pysc2.lib import features
+
+from . import tactics
+
+FUNCTIONS = actions.FUNCTIONS
+
+VERSION = 1
+MAX_ARGS = 6 # flattened argument values kept, select_rect has 5
+PLAYER_FIELDS = ("minerals", "vespene", "food_used", "food_cap", "army_count")
+FIELDS = ("step", "game_loop", "tactic", "phase", "wasted", "function") + \
+         tuple("arg%d" % k for k in range(MAX_ARGS)) + PLAYER_FIELDS + ("reward",)
+COLUMN = {name: k for k, name in enumerate(FIELDS)}
+
+# phase of the step, see tactics.PHASES
+PHASES = tactics.PHASES
+
+_PLAYER_COLUMNS = [int(getattr(features.Player, name)) for name in PLAYER_FIELDS]
+_SCREEN_FUNCTIONS = frozenset(f.id for f in FUNCTIONS if f.name.endswith("_screen"))
+
+
+class DecisionTracer:
+    """
+    ring buffers of the decisions of all envs of one TacticAgent
+    """
+
+    def __init__(self, path, capacity=1024, anomaly_streak=16):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.anomaly_streak = anomaly_streak
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1) # keeps the flushes in order
+        self._pending = []
+        self._tactic_names = None
+        self.rings = np.zeros((0, capacity, len(FIELDS)), dtype=np.int32)
+
+    def reset_envs(self, n_envs, tactic_names):
+        """
+        called by TacticAgent.reset_envs, keeps the rings and episode counts if n_envs did not change
+        """
+        if len(self.rings) != n_envs:
+            self.rings = np.zeros((n_envs, self.capacity, len(FIELDS)), dtype=np.int32)
+            # python ints, read and written every step
+            self.episodes = [0] * n_envs # episodes started
+            self.steps = [0] * n_envs # steps recorded this episode
+            self.flushed = [0] * n_envs # steps recorded when the last flush happened
+            self.streak = [0] * n_envs # wasted no_op frames in a row
+            self.quiet_until = [0] * n_envs # no anomaly flush before this step
+        for i in range(n_envs):
+            self.start_episode(i)
+        if tactic_names != self._tactic_names:
+            self._tactic_names = tactic_names
+            self._write_meta(tactic_names)
+
+    def start_episode(self, i):
+        """
+        called by TacticAgent.reset_env, flushes the steps of an episode that did not reach its last step
+        """
+        if self.steps[i] > self.flushed[i]:
+            self.flush(i, "reset")
+        self.episodes[i] += 1
+        self.steps[i] = 0
+        self.flushed[i] = 0
+        self.streak[i] = 0
+        self.quiet_until[i] = 0
+
+    def record(self, i, obs, tactic_idx, phase, action, wasted):
+        step = self.steps[i]
+        game_loop = int(obs.observation.game_loop[0]) if "game_loop" in obs.observation else 0
+        args = [int(value) for argument in action.arguments for value in argument][:MAX_ARGS]
+        player = np.asarray(obs.observation.player).tolist() # indexing the named array itself is slow
+        # the whole row in one assignment, from python ints
+        self.rings[i, step % self.capacity] = [step, game_loop, int(tactic_idx), phase, int(wasted), int(action.function)] + \
+            args + [0] * (MAX_ARGS - len(args)) + [player[k] for k in _PLAYER_COLUMNS] + [int(obs.reward or 0)]
+        self.steps[i] = step + 1
+
+        self.streak[i] = self.streak[i] + 1 if wasted else 0
+        if obs.last():
+            self.flush(i, "episode")
+        elif step >= self.quiet_until[i]:
+            if self.streak[i] >= self.anomaly_streak:
+                self.anomaly(i, "no_op_streak")
+            elif action.function in _SCREEN_FUNCTIONS and args[-2:] == [0, 0]:
+                self.anomaly(i, "zero_target")
+
+    def anomaly(self, i, reason):
+        """
+        flush env i now, the next anomaly flush of env i waits until the ring was overwritten once
+        """
+        self.quiet_until[i] = self.steps[i] + self.capacity
+        self.flush(i, reason)
+
+    def rows(self, i):
+        """
+        :return rows: copy of the rows of env i still in the ring, in step order
+        """
+        steps = self.steps[i]
+        if steps <= self.capacity:
+            return self.rings[i, :steps].copy()
+        start = steps % self.capacity
+        return np.concatenate([self.rings[i, start:], self.rings[i, :start]])
+
+    def flush(self, i, reason):
+        self.flushed[i] = self.steps[i]
+        name = "env%d_ep%05d_%06d_%s.npy" % (i, self.episodes[i], self.steps[i], reason)
+        self._submit(_save, os.path.join(self.path, name), self.rows(i))
+
+    def _write_meta(self, tactic_names):
+        meta = {"version": VERSION, "fields": list(FIELDS), "phases": list(PHASES), "tactics": list(tactic_names),
+                "capacity": self.capacity}
+        self._submit(_save_json, os.path.join(self.path, "meta.json"), meta)
+
+    def _submit(self, func, *argv):
+        self._pending = [future for future in self._pending if not future.done()]
+        self._pending.append(self._writer.submit(func, *argv))
+
+    def wait(self):
+        """
+        block until every flush so far is on disk, re-raises errors of the flushes still pending
+        """
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+    def close(self):
+        self.wait()
+        self._writer.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *argv):
+        self.close()
+
+
+def _save(path, rows):
+    info = np.iinfo(np.int16)
+    if rows.size == 0 or (rows.min() >= info.min and rows.max() <= info.max):
+        rows = rows.astype(np.int16)
+    np.save(path, rows)
+
+def _save_json(path, meta):
+    with open(path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load(path):
+    """
+    :return meta: meta.json of the trace directory
+    :return rows: [n_rows, len(FIELDS)] int32 rows of the flush file path
+    """
+    with open(os.path.join(os.path.dirname(path), "meta.json")) as f:
+        meta = json.load(f)
+    return meta, np.load(path).astype(np.int32)
+
+def describe(meta, rows):
+    """
+    :return lines: one readable line per row
+    """
+    lines = []
+    column = {name: k for k, name in enumerate(meta["fields"])}
+    args = [column["arg%d" % k] for k in range(MAX_ARGS)]
+    for row in rows.tolist():
+        tactic = row[column["tactic"]]
+        lines.append("%6d %7d %-32s %-13s %-28s %-22s %s%s" % (
+            row[column["step"]], row[column["game_loop"]],
+            meta["tactics"][tactic] if 0 <= tactic < len(meta["tactics"]) else "-",
+            meta["phases"][row[column["phase"]]],
+            FUNCTIONS[row[column["function"]]].name,
+            [row[k] for k in args],
+            " ".join("%s=%d" % (name, row[column[name]]) for name in PLAYER_FIELDS + ("reward",)),
+            " wasted" if row[column["wasted"]] else ""))
+    return lines
+
+
+if __name__ == "__main__":
+    for pattern in sys.argv[1:]:
+        for path in sorted(glob.glob(pattern)):
+            print(path)
+            print("\n".join(describe(*load(path))))
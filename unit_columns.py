@@ -0,0 +1,59 @@
+"""
+zero-copy column views over feature_units
+author: lzhbrian (https://lzhbrian.me)
+date: 2019.5.18
+license: MIT
+
+feature_units is one [n_units, n_fields] array, reading it unit by unit (unit.x, unit.y, ...)
+goes through a named-array lookup per field and builds python objects per unit.
+UnitColumns exposes the fields the agents read as views into that array instead,
+built with basic slicing only, so nothing is copied and every helper works on whole columns.
+x and y are adjacent fields, so xy is a [n_units, 2] view as well.
+
+Usage:
+    cols = UnitColumns(obs.observation.feature_units)
+    marines = np.flatnonzero(cols.types == units.Terran.Marine)
+    cols.xy[marines], cols.order_length[marines]
+"""
+
+import numpy as np
+from pysc2.lib import features
+
+FU = features.FeatureUnit
+N_FIELDS = len(FU)
+
+
+def as_array(feature_units):
+    """
+    :return array: feature_units as a plain [n_units, N_FIELDS] ndarray, a view if it already is one
+    """
+    return np.asarray(feature_units).reshape(-1, N_FIELDS)
+
+
+class UnitColumns:
+    __slots__ = ("array", "types", "alliance", "health", "shield", "build_progress", "xs", "ys", "xy", "radius",
+                 "is_selected", "mineral_contents", "assigned_harvesters", "order_length", "tags")
+
+    def __init__(self, feature_units):
+        fu = as_array(feature_units)
+        self.array = fu
+        self.types = fu[:, FU.unit_type]
+        self.alliance = fu[:, FU.alliance]
+        self.health = fu[:, FU.health]
+        self.shield = fu[:, FU.shield]
+        self.build_progress = fu[:, FU.build_progress]
+        self.xs = fu[:, FU.x]
+        self.ys = fu[:, FU.y]
+        self.xy = fu[:, FU.x:FU.y + 1]
+        self.radius = fu[:, FU.radius]
+        self.is_selected = fu[:, FU.is_selected]
+        self.mineral_contents = fu[:, FU.mineral_contents]
+        self.assigned_harvesters = fu[:, FU.assigned_harvesters]
+        self.order_length = fu[:, FU.order_length]
+        self.tags = fu[:, FU.tag]
+
+    def __len__(self):
+        return len(self.array)
+
+    def pos(self, i):
+        return [int(self.xs[i]), int(self.ys[i])]